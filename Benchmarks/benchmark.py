@@ -0,0 +1,167 @@
+# LiveTVH benchmarks - runs LiveTVH against the mock Tvheadend, theTVDB and TMDb server
+# Each scenario runs in its own process and reports the time, memory and requests for each step
+#
+# Usage: python2 Benchmarks/benchmark.py [scenario ...] [--tvh-latency SECONDS] [--provider-latency SECONDS] [--verbose]
+
+import argparse
+import gc
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import framework
+import mockserver
+
+# Scenarios as (channels, EPG events, recordings)
+scenarios = (
+    ('small', (50, 1000, 100)),
+    ('medium', (500, 20000, 2000)),
+    ('large', (2000, 100000, 10000)))
+
+# Preferences used for every scenario
+benchmarkPrefs = {
+    'tvhAddress': None,
+    'tvhUser': 'benchmark',
+    'tvhPass': 'benchmark',
+    'tvhProfile': 'pass',
+    'prefChannelNumbers': True,
+    'pref24Time': False,
+    'prefPageCount': '30',
+    'prefEPGCount': '3',
+    'prefMetadata': True,
+    'prefDirectStream': True,
+    'prefFastZap': True,
+    'prefUnverifiedSSL': False}
+
+
+# Memory used by this process in KB
+def memoryUsed():
+    try:
+        with open('/proc/self/status') as statusFile:
+            for statusLine in statusFile:
+                if statusLine.startswith('VmRSS:'):
+                    return int(statusLine.split()[1])
+    except IOError: pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Runs one step of a scenario, recording its time, memory and requests
+def runStep(results, server, stepName, step):
+    gc.collect()
+    server.takeCounters()
+    memoryBefore = memoryUsed()
+    stepStart = time.time()
+    stepResult = step()
+    stepTime = time.time() - stepStart
+    gc.collect()
+
+    stepCounters = server.takeCounters()
+    results.append({
+        'step': stepName,
+        'time': stepTime,
+        'memory': memoryUsed() - memoryBefore,
+        'requests': sum(v for k, v in stepCounters.items() if k not in ('bytes', 'connections')),
+        'bytes': stepCounters.get('bytes', 0),
+        'connections': stepCounters.get('connections', 0),
+        'counters': stepCounters})
+
+    return stepResult
+
+
+# Runs a scenario in this process and prints the results as JSON
+def runScenario(scenarioName, tvhLatency, providerLatency, verbose):
+    channelCount, eventCount, recordingCount = dict(scenarios)[scenarioName]
+    server = mockserver.MockServer(mockserver.mockData(channelCount, eventCount, recordingCount), tvhLatency, providerLatency).start()
+
+    dataPath = tempfile.mkdtemp(prefix='livetvh-benchmark-')
+    try:
+        prefs = dict(benchmarkPrefs, tvhAddress=server.address())
+        plugin = framework.loadPlugin(framework.pluginGlobals(server.address(), prefs, dataPath, verbose))
+        memoryStart = memoryUsed()
+        results = []
+
+        # The background snapshot and prefetch threads are not started so each step is measured on its own
+        runStep(results, server, 'setPrefs', plugin['setPrefs'])
+        runStep(results, server, 'snapshot (cold)', plugin['refreshSnapshot'])
+        runStep(results, server, 'snapshot (update)', lambda: plugin['refreshSnapshot'](forceRefresh=True))
+        runStep(results, server, 'channels page 1 (cold)', plugin['channels'])
+        runStep(results, server, 'channels page 1 (cached)', plugin['channels'])
+        runStep(results, server, 'channels page 2', lambda: plugin['channels'](startCount=30))
+        runStep(results, server, 'jump to channel', lambda: plugin['jumpToChannel'](query=str(channelCount // 2)))
+        runStep(results, server, 'recordings page 1', plugin['recordings'])
+        runStep(results, server, 'recordings search', lambda: plugin['searchRecordings'](query='show 1'))
+        runStep(results, server, 'recording series', plugin['recordingSeries'])
+        runStep(results, server, 'guide now', plugin['guideSlot'])
+        runStep(results, server, 'guide channel', lambda: plugin['guideChannel'](uuid='channel00001'))
+        runStep(results, server, 'guide search', lambda: plugin['searchGuide'](query='show 12'))
+        runStep(results, server, 'stream check', lambda: plugin['stream']('/stream/channel/channel00001'))
+
+        print json.dumps({
+            'scenario': scenarioName,
+            'channels': channelCount,
+            'events': eventCount,
+            'recordings': recordingCount,
+            'memory': memoryUsed() - memoryStart,
+            'steps': results})
+
+    finally:
+        server.shutdown()
+        shutil.rmtree(dataPath, True)
+
+
+# Prints a table of the results of a scenario
+def printResults(scenarioResults):
+    print '{scenario}: {channels} channels, {events} EPG events, {recordings} recordings, {memory:,} KB'.format(**scenarioResults)
+    print '  {:<28}{:>10}{:>12}{:>10}{:>14}'.format('step', 'ms', 'memory KB', 'requests', 'bytes')
+    for stepResult in scenarioResults['steps']:
+        print '  {:<28}{:>10.1f}{:>12,}{:>10}{:>14,}'.format(
+            stepResult['step'], stepResult['time'] * 1000, stepResult['memory'], stepResult['requests'], stepResult['bytes'])
+    print
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark LiveTVH against a mock Tvheadend, theTVDB and TMDb server')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run, all by default')
+    parser.add_argument('--tvh-latency', type=float, default=0.0, help='seconds added to each Tvheadend response')
+    parser.add_argument('--provider-latency', type=float, default=0.0, help='seconds added to each theTVDB and TMDb response')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--verbose', action='store_true', help='print LiveTVH log messages')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Scenarios exit without waiting for LiveTVH threads and pooled Tvheadend connections
+    if args.run:
+        runScenario(args.run, args.tvh_latency, args.provider_latency, args.verbose)
+        sys.stdout.flush()
+        os._exit(0)
+
+    for scenarioName in args.scenarios or [s[0] for s in scenarios]:
+        if scenarioName not in dict(scenarios):
+            parser.error('unknown scenario: {}'.format(scenarioName))
+
+        scenarioCommand = [
+            sys.executable, os.path.abspath(__file__), '--run', scenarioName,
+            '--tvh-latency', str(args.tvh_latency), '--provider-latency', str(args.provider_latency)]
+        if args.verbose:
+            scenarioCommand.append('--verbose')
+
+        scenarioOutput = subprocess.check_output(scenarioCommand)
+        scenarioLines = scenarioOutput.strip().splitlines()
+        for logLine in scenarioLines[:-1]:
+            print logLine
+
+        scenarioResults = json.loads(scenarioLines[-1])
+        if args.json:
+            print json.dumps(scenarioResults)
+        else:
+            printResults(scenarioResults)
+
+
+if __name__ == '__main__':
+    main()
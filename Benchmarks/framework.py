@@ -0,0 +1,271 @@
+# LiveTVH benchmarks - a stand-in for the Plex Framework globals used by LiveTVH
+# Only the parts of the framework used by Contents/Code/__init__.py are provided
+
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import urllib
+import urllib2
+
+# Plex runs plugins with UTF-8 as the default encoding
+reload(sys)
+sys.setdefaultencoding('utf-8')
+
+# Requests to theTVDB and TMDb are sent to the mock server instead
+providerHosts = (
+    ('https://api.thetvdb.com/', '/tvdb/'),
+    ('https://api.themoviedb.org/', '/tmdb/'))
+
+
+# Objects returned to Plex clients keep their arguments and the objects added to them
+class FrameworkObject(object):
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.objects = list(kwargs.get('objects', []))
+
+    def add(self, frameworkObject):
+        self.objects.append(frameworkObject)
+
+    def __len__(self):
+        return len(self.objects)
+
+
+class Logger(object):
+    def __init__(self, verbose):
+        self.verbose = verbose
+
+    def log(self, level, message):
+        if self.verbose or level in ('Warn', 'Critical', 'Exception'):
+            print '[{}] {}'.format(level, message)
+
+    def __call__(self, message): self.log('Info', message)
+    def Debug(self, message): self.log('Debug', message)
+    def Info(self, message): self.log('Info', message)
+    def Warn(self, message): self.log('Warn', message)
+    def Error(self, message): self.log('Error', message)
+    def Critical(self, message): self.log('Critical', message)
+    def Exception(self, message): self.log('Exception', message)
+
+
+class FrameworkExceptions(object):
+    HTTPError = urllib2.HTTPError
+
+    class MediaNotAvailable(Exception):
+        pass
+
+
+class HTTPResponse(object):
+    def __init__(self, content, headers):
+        self.content = content
+        self.headers = headers
+
+
+# Sends provider requests to the mock server
+class FrameworkHTTP(object):
+    def __init__(self, mockAddress):
+        self.mockAddress = mockAddress
+
+    def providerURL(self, url):
+        for providerHost, mockPath in providerHosts:
+            if url.startswith(providerHost):
+                return self.mockAddress + mockPath + url[len(providerHost):]
+        return url
+
+    def Request(self, url, headers={}, cacheTime=None, values=None, timeout=None, data=None, **kwargs):
+        response = urllib2.urlopen(urllib2.Request(self.providerURL(url), data, headers), timeout=timeout or 30)
+        return HTTPResponse(response.read(), dict(response.info().items()))
+
+
+# Plex returns ASCII strings as str and other strings as unicode
+def plexStrings(jsonObject):
+    if isinstance(jsonObject, dict):
+        return dict((plexStrings(k), plexStrings(v)) for k, v in jsonObject.items())
+    if isinstance(jsonObject, list):
+        return [plexStrings(v) for v in jsonObject]
+    if isinstance(jsonObject, unicode):
+        try:
+            return jsonObject.encode('ascii')
+        except UnicodeEncodeError:
+            return jsonObject
+    return jsonObject
+
+
+class FrameworkJSON(object):
+    def __init__(self, frameworkHTTP):
+        self.frameworkHTTP = frameworkHTTP
+
+    def ObjectFromString(self, jsonString, encoding=None, max_size=None):
+        if max_size and len(jsonString) > max_size:
+            raise Exception('Data of size {} is greater than the maximum size {}'.format(len(jsonString), max_size))
+        if encoding:
+            return plexStrings(json.loads(jsonString, encoding=encoding))
+        return plexStrings(json.loads(jsonString))
+
+    def ObjectFromURL(self, url, values=None, headers={}, cacheTime=None, **kwargs):
+        return self.ObjectFromString(self.frameworkHTTP.Request(url, headers=headers).content)
+
+    def StringFromObject(self, jsonObject):
+        return json.dumps(jsonObject)
+
+
+class FrameworkThread(object):
+    def __init__(self):
+        self.locks = {}
+        self.locksLock = threading.Lock()
+
+    def Create(self, function, globalize=True, *args, **kwargs):
+        thread = threading.Thread(target=function, args=args, kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def Sleep(self, seconds):
+        time.sleep(seconds)
+
+    def Lock(self, key=None):
+        if key is None:
+            return threading.RLock()
+        with self.locksLock:
+            return self.locks.setdefault(key, threading.RLock())
+
+    def AcquireLock(self, key):
+        self.Lock(key).acquire()
+
+    def ReleaseLock(self, key):
+        self.Lock(key).release()
+
+    def Event(self, key=None):
+        return threading.Event()
+
+
+class FrameworkData(object):
+    def __init__(self, dataPath):
+        self.dataPath = dataPath
+        if not os.path.isdir(dataPath):
+            os.makedirs(dataPath)
+
+    def path(self, name):
+        return os.path.join(self.dataPath, name)
+
+    def Load(self, name):
+        with open(self.path(name), 'rb') as dataFile:
+            return dataFile.read()
+
+    def Save(self, name, data):
+        with open(self.path(name), 'wb') as dataFile:
+            dataFile.write(data)
+
+    def LoadObject(self, name):
+        with open(self.path(name), 'rb') as dataFile:
+            return pickle.load(dataFile)
+
+    def SaveObject(self, name, dataObject):
+        with open(self.path(name), 'wb') as dataFile:
+            pickle.dump(dataObject, dataFile)
+
+    def Exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def Remove(self, name):
+        if self.Exists(name):
+            os.remove(self.path(name))
+
+
+class FrameworkHash(object):
+    def MD5(self, data):
+        return hashlib.md5(data).hexdigest()
+
+    def SHA1(self, data):
+        return hashlib.sha1(data).hexdigest()
+
+
+class FrameworkString(object):
+    def Quote(self, text, usePlus=False):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        if usePlus:
+            return urllib.quote_plus(text)
+        return urllib.quote(text)
+
+    def LevenshteinDistance(self, first, second):
+        previousRow = range(len(second) + 1)
+        for i, firstChar in enumerate(first):
+            currentRow = [i + 1]
+            for j, secondChar in enumerate(second):
+                currentRow.append(min(previousRow[j + 1] + 1, currentRow[j] + 1, previousRow[j] + (firstChar != secondChar)))
+            previousRow = currentRow
+        return previousRow[-1]
+
+
+class FrameworkClient(object):
+    Product = 'Plex Web'
+    Platform = 'Chrome'
+
+
+class FrameworkPlatform(object):
+    OS = 'Linux'
+    CPU = 'x86_64'
+
+
+class Callback(object):
+    def __init__(self, function, **kwargs):
+        self.function = function
+        self.kwargs = kwargs
+
+
+# Builds the globals for running LiveTVH with the mock server
+def pluginGlobals(mockAddress, prefs, dataPath, verbose=False):
+    frameworkHTTP = FrameworkHTTP(mockAddress)
+
+    def route(*args, **kwargs):
+        return lambda function: function
+
+    pluginGlobals = {
+        '__name__': 'livetvh',
+        'Log': Logger(verbose),
+        'Prefs': prefs,
+        'JSON': FrameworkJSON(frameworkHTTP),
+        'HTTP': frameworkHTTP,
+        'Dict': {},
+        'Ex': FrameworkExceptions,
+        'Thread': FrameworkThread(),
+        'Data': FrameworkData(dataPath),
+        'Hash': FrameworkHash(),
+        'String': FrameworkString(),
+        'Client': FrameworkClient,
+        'Platform': FrameworkPlatform,
+        'CACHE_1MINUTE': 60,
+        'CACHE_1HOUR': 3600,
+        'CACHE_1DAY': 86400,
+        'CACHE_1WEEK': 604800,
+        'CACHE_1MONTH': 2592000,
+        'route': route,
+        'handler': route,
+        'indirect': lambda function: function,
+        'Callback': Callback,
+        'R': lambda name: '/resources/' + name,
+        'L': lambda name: name,
+        'Redirect': lambda url: ('Redirect', url),
+        'DataObject': lambda data, contentType: ('DataObject', data, contentType),
+        'IndirectResponse': lambda objectClass, key: ('IndirectResponse', key)}
+
+    for objectName in (
+            'ObjectContainer', 'DirectoryObject', 'NextPageObject', 'PrefsObject', 'InputDirectoryObject',
+            'MovieObject', 'VideoClipObject', 'TrackObject', 'TVShowObject', 'EpisodeObject',
+            'MediaObject', 'PartObject', 'VideoStreamObject', 'AudioStreamObject'):
+        pluginGlobals[objectName] = type(objectName, (FrameworkObject,), {})
+
+    return pluginGlobals
+
+
+# Runs Contents/Code/__init__.py with the framework globals
+def loadPlugin(pluginGlobals):
+    pluginPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Contents', 'Code', '__init__.py')
+    with open(pluginPath) as pluginFile:
+        exec compile(pluginFile.read(), pluginPath, 'exec') in pluginGlobals
+    return pluginGlobals
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# LiveTVH benchmarks - a local stand-in for Tvheadend, theTVDB and TMDb
+# Serves synthetic channels, EPG events and recordings at a configurable size, counting requests and bytes sent
+
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+import urlparse
+
+# Channel tags used to set the video/audio attributes of the synthetic channels
+mockTags = (
+    {'uuid': 'tag-h264', 'name': 'H264-AAC'},
+    {'uuid': 'tag-hdtv', 'name': 'HDTV'},
+    {'uuid': 'tag-mpeg2', 'name': 'MPEG2-AC3'},
+    {'uuid': 'tag-radio', 'name': 'Radio MP2'})
+
+
+# Builds synthetic Tvheadend data - every 10th channel is a sub-channel, and a few titles are not on theTVDB or TMDb
+def mockData(channelCount, eventCount, recordingCount, showLength=1800):
+    now = int(time.time())
+    showStart = now - now % showLength
+
+    channels = []
+    for channelIndex in range(channelCount):
+        if channelIndex % 10 == 9:
+            channelNumber = '{}.{}'.format(channelIndex, 1)
+        else:
+            channelNumber = channelIndex + 1
+
+        if channelIndex % 20 == 19:
+            channelTags = ['tag-radio']
+        elif channelIndex % 2:
+            channelTags = ['tag-h264', 'tag-hdtv']
+        else:
+            channelTags = ['tag-mpeg2']
+
+        channels.append({
+            'uuid': 'channel{:05d}'.format(channelIndex),
+            'name': 'Channel {}'.format(channelIndex),
+            'number': channelNumber,
+            'tags': channelTags,
+            'icon_public_url': 'imagecache/{}'.format(channelIndex)})
+
+    events = []
+    eventsPerChannel = max(1, eventCount // max(1, channelCount))
+    eventId = 1
+    for channelIndex in range(channelCount):
+        for showIndex in range(eventsPerChannel):
+            titleIndex = (channelIndex * 7 + showIndex) % 800
+            events.append({
+                'eventId': eventId,
+                'channelUuid': channels[channelIndex]['uuid'],
+                'channelName': channels[channelIndex]['name'],
+                'start': showStart + (showIndex - 1) * showLength,
+                'stop': showStart + showIndex * showLength,
+                'title': u'Show {} édition'.format(titleIndex) if titleIndex % 50 == 0 else 'Show {}'.format(titleIndex),
+                'subtitle': 'Episode {}'.format(showIndex),
+                'summary': 'Episode {}'.format(showIndex),
+                'description': 'Show {} episode {} on channel {}, a synthetic EPG event.'.format(titleIndex, showIndex, channelIndex),
+                'episodeUri': 'ddprogid:///EP{:06d}.{:04d}'.format(titleIndex, showIndex) if titleIndex % 3 else None,
+                'nextEventId': eventId + 1 if showIndex < eventsPerChannel - 1 else None})
+            eventId += 1
+
+    events.sort(key=lambda e: e['start'])
+
+    recordings = []
+    for recordingIndex in range(recordingCount):
+        recordingStart = showStart - (recordingIndex + 1) * 3600
+        recordings.append({
+            'uuid': 'recording{:06d}'.format(recordingIndex),
+            'disp_title': 'Show {}'.format(recordingIndex % 200),
+            'disp_subtitle': 'Episode {}'.format(recordingIndex),
+            'disp_description': 'Recording {} of show {}.'.format(recordingIndex, recordingIndex % 200),
+            'channel': channels[recordingIndex % channelCount]['uuid'] if channels else None,
+            'channelname': channels[recordingIndex % channelCount]['name'] if channels else None,
+            'channel_icon': 'imagecache/1',
+            'url': 'dvrfile/recording{:06d}'.format(recordingIndex),
+            'start': recordingStart,
+            'stop': recordingStart + 1800})
+
+    return {'channels': channels, 'tags': list(mockTags), 'events': events, 'recordings': recordings}
+
+
+# Applies Tvheadend grid filter, sort and paging parameters to a list of entries
+# Results are kept for the last filter and sort so paging through them does not filter the whole list again
+def gridResponse(server, gridName, entries, query):
+    gridStart = int(query.get('start', ['0'])[0])
+    gridLimit = int(query.get('limit', ['50'])[0])
+    gridKey = (gridName, query.get('filter', [None])[0], query.get('sort', [None])[0], query.get('dir', ['ASC'])[0])
+
+    with server.gridLock:
+        gridEntries = server.gridResults.get(gridKey)
+
+    if gridEntries is None:
+        gridEntries = entries
+        if gridKey[1]:
+            for gridFilter in json.loads(gridKey[1]):
+                filterField = gridFilter['field']
+                filterValue = gridFilter['value']
+                filterComparison = gridFilter.get('comparison', 'eq')
+                if filterComparison == 'gt':
+                    gridEntries = [e for e in gridEntries if e.get(filterField) > filterValue]
+                elif filterComparison == 'lt':
+                    gridEntries = [e for e in gridEntries if e.get(filterField) < filterValue]
+                else:
+                    gridEntries = [e for e in gridEntries if e.get(filterField) == filterValue]
+
+        if gridKey[2] and not (gridName == 'events' and gridKey[2] == 'start' and gridKey[3] == 'ASC'):
+            gridEntries = sorted(gridEntries, key=lambda e: e.get(gridKey[2]), reverse=gridKey[3] == 'DESC')
+
+        with server.gridLock:
+            server.gridResults = {gridKey: gridEntries}
+
+    return {'entries': gridEntries[gridStart:gridStart + gridLimit], 'total': len(gridEntries)}
+
+
+# theTVDB search results - titles ending in 0 have no results
+def tvdbResponse(path, query):
+    if path == '/tvdb/login':
+        return {'token': 'benchmark-token'}
+
+    if path == '/tvdb/search/series':
+        if 'zap2itId' in query:
+            showNumber = int(query['zap2itId'][0][2:8])
+            showName = 'Show {}'.format(showNumber)
+        else:
+            showName = query.get('name', [''])[0]
+            showNumber = int(''.join(c for c in showName if c.isdigit()) or 0)
+
+        if showNumber % 10 == 0:
+            return None
+
+        return {'data': [{'id': 70000 + showNumber, 'seriesName': showName}]}
+
+    if path.startswith('/tvdb/series/') and path.endswith('/images/query'):
+        return {'data': [{'fileName': 'posters/{}.jpg'.format(path.split('/')[3])}]}
+
+    if path.startswith('/tvdb/series/'):
+        return {'data': {'rating': 'TV-PG', 'siteRating': 7.5, 'genre': ['Drama', 'Comedy']}}
+
+    return None
+
+
+# TMDb search results - titles ending in 0 are found here instead of theTVDB
+def tmdbResponse(path, query):
+    if path == '/tmdb/3/configuration':
+        return {'images': {'base_url': 'http://image.tmdb.invalid/t/p/', 'backdrop_sizes': ['w300', 'w780', 'w1280', 'original']}}
+
+    if path == '/tmdb/3/genre/movie/list':
+        return {'genres': [{'id': 18, 'name': 'Drama'}, {'id': 35, 'name': 'Comedy'}]}
+
+    if path == '/tmdb/3/search/multi':
+        title = query.get('query', [''])[0].decode('utf-8')
+        return {'total_results': 1, 'results': [{
+            'media_type': 'movie',
+            'title': title,
+            'poster_path': '/poster.jpg',
+            'backdrop_path': '/backdrop.jpg',
+            'vote_average': 6.5,
+            'release_date': '2017-01-01',
+            'genre_ids': [18]}]}
+
+    return None
+
+
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.count('connections')
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.respond()
+
+    def respond(self):
+        urlParts = urlparse.urlsplit(self.path)
+        path = urlParts.path
+        query = urlparse.parse_qs(urlParts.query)
+        data = self.server.data
+
+        if path.startswith('/tvdb/') or path.startswith('/tmdb/'):
+            time.sleep(self.server.providerLatency)
+        else:
+            time.sleep(self.server.tvhLatency)
+
+        if path == '/api/serverinfo':
+            response = {'sw_version': '4.2.8', 'api_version': 19}
+        elif path == '/api/channel/grid':
+            response = gridResponse(self.server, 'channels', data['channels'], query)
+        elif path == '/api/channeltag/grid':
+            response = gridResponse(self.server, 'tags', data['tags'], query)
+        elif path == '/api/epg/events/grid':
+            response = gridResponse(self.server, 'events', data['events'], query)
+        elif path == '/api/dvr/entry/grid_finished':
+            response = gridResponse(self.server, 'recordings', data['recordings'], query)
+        elif path == '/api/status/inputs':
+            response = {'entries': [{'uuid': 'input1', 'input': 'Tuner 1', 'subs': 0}]}
+        elif path == '/api/status/subscriptions':
+            response = {'entries': []}
+        elif path.startswith('/tvdb/'):
+            response = tvdbResponse(path, query)
+        elif path.startswith('/tmdb/'):
+            response = tmdbResponse(path, query)
+        else:
+            response = None
+
+        if path.startswith('/api/'):
+            self.server.count(path)
+        elif path.startswith('/stream/') or path.startswith('/imagecache/') or path.startswith('/dvrfile/'):
+            self.server.count('/' + path.split('/')[1])
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            self.wfile.write('mock')
+            return
+        else:
+            self.server.count('/' + path.split('/')[1])
+
+        if response is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        responseData = json.dumps(response)
+        self.server.count('bytes', len(responseData))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(responseData)))
+        self.end_headers()
+        self.wfile.write(responseData)
+
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data, tvhLatency=0.0, providerLatency=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), MockHandler)
+        self.data = data
+        self.tvhLatency = tvhLatency
+        self.providerLatency = providerLatency
+        self.counters = {}
+        self.countersLock = threading.Lock()
+        self.gridResults = {}
+        self.gridLock = threading.Lock()
+
+    def address(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def count(self, name, amount=1):
+        with self.countersLock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def takeCounters(self):
+        with self.countersLock:
+            counters = self.counters
+            self.counters = {}
+            return counters
+
+    def start(self):
+        serverThread = threading.Thread(target=self.serve_forever)
+        serverThread.daemon = True
+        serverThread.start()
+        return self
@@ -3,7 +3,14 @@
 
 import time
 import re
+import bisect
+import collections
+import contextlib
 import urllib2
+import urlparse
+import httplib
+import socket
+import base64
 import ssl
 
 # Preferences
@@ -16,8 +23,73 @@ improveTheTVDB = True
 
 # Cache times
 imageCacheTime = CACHE_1MONTH
+imageRevalidateTime = CACHE_1DAY
 tvdbRetryInterval = CACHE_1MONTH
 httpTimeout = 3
+tvhTimeout = 60
+
+# Maximum number of idle keep-alive connections to Tvheadend
+tvhPoolSize = 4
+
+# Number of recordings to request at a time when checking the recordings search index for removed recordings
+recordingsPageSize = 1000
+
+# Maximum number of channel list pages to keep for reuse
+pageCacheSize = 100
+
+# Seconds to keep the result of checking if a channel is available
+streamProbeCacheTime = 10
+
+# Seconds after a channel is verified as available that it is played directly when fast channel changes are enabled
+fastZapTime = 300
+
+# Metadata cache - seconds to keep titles found and not found on theTVDB/TMDb, and the maximum number of titles
+metadataCacheTime = CACHE_1WEEK
+metadataMissCacheTime = CACHE_1DAY
+metadataCacheSize = 5000
+
+# Image cache - maximum size in bytes, and the width to request for background artwork
+imageCacheSize = 209715200
+imageArtWidth = 1280
+
+# Number of metadata searches to run at the same time, and seconds to wait for them before displaying a page
+metadataThreads = 6
+metadataPageTimeout = 8
+
+# Metadata prefetching - hours of upcoming shows to search for ahead of time, titles to search per second,
+# and seconds between searches of the EPG for new titles
+prefetchHours = 2
+prefetchRate = 0.5
+prefetchInterval = 300
+
+# Seconds between background updates of the Tvheadend channel, recordings and EPG data, and seconds to wait for
+# the data before updating without it
+snapshotRefreshInterval = 300
+snapshotFetchTimeout = 30
+
+# EPG synchronization - hours of upcoming shows to keep, seconds between full updates of the EPG window,
+# and the number of EPG events in the first request
+epgWindowHours = 24
+epgFullSyncInterval = 10800
+epgPageSize = 1000
+
+# Later EPG requests are sized from the average size of events to receive about epgPageBytes at a time,
+# between epgPageMinimum and epgPageMaximum events
+epgPageBytes = 1048576
+epgPageMinimum = 50
+epgPageMaximum = 20000
+
+# Upper bounds in seconds of the latency histogram buckets on the stats page
+statsBuckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Bytes to read at a time from Tvheadend grid responses
+gridChunkSize = 65536
+
+# Maximum number of upcoming shows to follow in the EPG for each channel
+epgUpcomingLimit = 50
+
+# Seconds in each time slot of the guide
+guideSlotTime = 1800
 
 # /Preferences
 
@@ -28,10 +100,44 @@ THUMB = 'icon-default.png'
 ART = 'art-default.jpg'
 
 tvhAddress = None
+tvhServer = None
 tvhReachable = False
+tvhSnapshot = None
+snapshotFetches = set()
+snapshotLateResults = {}
+tvhAuth = None
+tvhPool = {}
+tvhPoolStats = {'hits': 0, 'misses': 0, 'challenges': 0}
+pageCache = collections.OrderedDict()
+streamProbeCache = {}
+streamVerifiedTimes = {}
+tvhStatusAccess = None
+epgEvents = {}
+recordingsIndex = {}
+recordingsTokens = {}
+recordingsTokenList = []
+recordingsSeries = {}
+recordingsSyncedUntil = 0
+epgSyncedUntil = 0
+epgFullSyncTime = 0
+epgPageLimit = epgPageSize
+epgPageCeiling = epgPageMaximum
+tvhGridEncodings = {}
 tvdbToken = None
 tmdbBaseURL = None
 tmdbGenreData = None
+tmdbBackdropSizes = []
+metadataCache = collections.OrderedDict()
+metadataCacheChanged = False
+metadataSearches = {}
+imageCacheIndex = {}
+imageCacheFiles = collections.OrderedDict()
+imageCacheBytes = 0
+imageCacheChanged = False
+statsSpans = {}
+statsCounters = collections.defaultdict(int)
+statsStartTime = time.time()
+verifiedSSL = ssl.create_default_context()
 unverifiedSSL = ssl.create_default_context()
 unverifiedSSL.check_hostname = False
 unverifiedSSL.verify_mode = ssl.CERT_NONE
@@ -41,48 +147,71 @@ debug = True
 def Start():
     Log.Info('LiveTVH version: ' + liveTVHVersion)
     setPrefs()
+    loadMetadataCache()
+    loadImageCache()
+    Thread.Create(snapshotRefresher)
+    Thread.Create(metadataPrefetcher)
 
 
 @route(PREFIX + '/validateprefs')
 def ValidatePrefs():
     setPrefs()
+    Thread.Create(refreshSnapshot)
     return True
 
 
+# Clears the EPG events and recordings search index synchronized from Tvheadend
+def clearTvheadendData():
+    global epgEvents
+    global epgSyncedUntil
+    global epgFullSyncTime
+    global recordingsSyncedUntil
+
+    epgEvents = {}
+    epgSyncedUntil = 0
+    epgFullSyncTime = 0
+
+    Thread.AcquireLock('recordingsIndex')
+    try:
+        recordingsIndex.clear()
+        recordingsTokens.clear()
+        del recordingsTokenList[:]
+        recordingsSeries.clear()
+        recordingsSyncedUntil = 0
+    finally:
+        Thread.ReleaseLock('recordingsIndex')
+
+
 # Setup authorization and configuration data
 @route(PREFIX + '/setprefs')
 def setPrefs():
     global tvhAddress
+    global tvhServer
     global tvhReachable
+    global tvhAuth
+    global tvhStatusAccess
     global tvdbToken
     global tmdbBaseURL
     global tmdbGenreData
-    tvhRealm = None
-    tvhAuthType = None
-    tvhAuthHandler = urllib2.HTTPDigestAuthHandler()
+    global tmdbBackdropSizes
     tvhAddress = Prefs['tvhAddress'].rstrip('/')
     tvhServerInfoURL = str(tvhAddress) + '/api/serverinfo'
 
-    # Gets the Tvheadend HTTP authentication type and realm
-    try:
-        response = urllib2.urlopen(tvhServerInfoURL).info()
-    except urllib2.HTTPError as e:
-        tvhAuthInfo = e.info().getheader('WWW-Authenticate')
+    # Closes connections to the previous Tvheadend address and clears the authorization, which is set again
+    # from the HTTP authentication type and realm of the first response
+    tvhAuth = None
+    tvhCloseConnections()
+    tvhStatusAccess = None
 
-        if 'Basic' in str(tvhAuthInfo):
-            tvhAuthHandler = urllib2.HTTPBasicAuthHandler()
-
-        tvhRealm = (re.search("realm=\"[^\"]*", tvhAuthInfo).group(0).split('"'))[1]
-        tvhAuthHandler.add_password(tvhRealm, tvhAddress, Prefs['tvhUser'], Prefs['tvhPass'])
-        tvhOpener = urllib2.build_opener(tvhAuthHandler)
-        urllib2.install_opener(tvhOpener)
-
-    except Exception as e:
-        Log.Info('Error accessing Tvheadend: ' + str(e))
+    # Clears the EPG and recordings kept from a different Tvheadend server or user, so the next update requests
+    # the full EPG window and all recordings
+    if tvhServer != (tvhAddress, Prefs['tvhUser'], Prefs['tvhPass']):
+        tvhServer = (tvhAddress, Prefs['tvhUser'], Prefs['tvhPass'])
+        clearTvheadendData()
 
     # Checks for connectivity to Tvheadend
     try:
-        tvhInfoData = JSON.ObjectFromString(urllib2.urlopen(tvhServerInfoURL).read())
+        tvhInfoData = JSON.ObjectFromString(tvhRead(tvhServerInfoURL))
         Log.Info('Tvheadend version: ' + tvhInfoData['sw_version'])
 
         if tvhInfoData['api_version'] >= 15:
@@ -98,7 +227,8 @@ def setPrefs():
     # Renews theTVDB authorization token if necessary
     if Prefs['prefMetadata'] and tvdbToken:
         tvdbToken = None
-        tvdbAuth()
+        with statsSpan('tvdb.login'):
+            tvdbAuth()
 
     # Retrieves themovieDB base URL for images and genre list
     if Prefs['prefMetadata']:
@@ -106,14 +236,306 @@ def setPrefs():
         tmdbGenreURL = 'https://api.themoviedb.org/3/genre/movie/list?api_key=0fd2136e80c47d0e371ee1af87eaedde'
 
         try:
-            tmdbConfigData = JSON.ObjectFromURL(url=tmdbConfigURL, values=None, cacheTime=1)
-            tmdbGenreData = JSON.ObjectFromURL(url=tmdbGenreURL, values=None, cacheTime=1)
+            with statsSpan('tmdb.configuration'):
+                tmdbConfigData = JSON.ObjectFromURL(url=tmdbConfigURL, values=None, cacheTime=1)
+                tmdbGenreData = JSON.ObjectFromURL(url=tmdbGenreURL, values=None, cacheTime=1)
             tmdbBaseURL = tmdbConfigData['images']['base_url']
+            tmdbBackdropSizes = tmdbConfigData['images']['backdrop_sizes']
 
         except Exception as e:
             Log.Warn('Error accessing themovieDB: ' + str(e))
 
 
+# Sends a request to Tvheadend on a pooled keep-alive connection, adding the cached authorization
+# The response must be passed to tvhRelease after reading to return the connection to the pool
+def tvhOpen(url, requestHeaders=None):
+
+    # Time API requests by path, and other requests such as images by the first part of the path
+    urlPath = urlparse.urlsplit(url).path
+    if '/api/' not in urlPath:
+        urlPath = urlPath.rsplit('/', 1)[0] or urlPath
+
+    with statsSpan('tvheadend:' + urlPath):
+        return tvhRequest(url, requestHeaders)
+
+
+# Sends a request to Tvheadend, retrying on a new connection and responding to authentication challenges
+def tvhRequest(url, requestHeaders=None):
+    global tvhAuth
+
+    urlParts = urlparse.urlsplit(url)
+    urlPath = urlParts.path or '/'
+    if urlParts.query:
+        urlPath = urlPath + '?' + urlParts.query
+
+    for tvhAttempt in range(3):
+        connection, connectionReused = tvhConnection(urlParts.scheme, urlParts.netloc)
+        headers = dict(requestHeaders or {})
+        tvhAuthorization = tvhAuthHeader('GET', urlPath)
+        if tvhAuthorization:
+            headers['Authorization'] = tvhAuthorization
+
+        try:
+            connection.request('GET', urlPath, headers=headers)
+            response = connection.getresponse()
+
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+
+            # Tvheadend may have closed an idle connection, so try again with a new one
+            if connectionReused:
+                continue
+            raise
+
+        response.tvhConnection = connection
+        response.tvhNetloc = (urlParts.scheme, urlParts.netloc)
+
+        # Set the authorization from the Tvheadend authentication challenge, including expired Digest nonces
+        if response.status == 401 and tvhAttempt < 2 and Prefs['tvhUser']:
+            tvhChallenge = response.getheader('WWW-Authenticate')
+            tvhRelease(response, True)
+            tvhPoolStats['challenges'] += 1
+            tvhAuth = tvhAuthChallenge(tvhChallenge)
+            if tvhAuth:
+                continue
+
+        if response.status >= 400 or response.status == 304:
+            tvhRelease(response, True)
+            raise urllib2.HTTPError(url, response.status, response.reason, response.msg, None)
+
+        return response
+
+    raise urllib2.URLError('Unable to connect to Tvheadend')
+
+
+# Returns a connection to the pool if the response was read completely, otherwise closes it
+def tvhRelease(response, readResponse=False):
+    if readResponse:
+        try:
+            response.read()
+        except (httplib.HTTPException, socket.error): pass
+
+    if response.isclosed() and not response.will_close:
+        Thread.AcquireLock('tvhPool')
+        try:
+            tvhIdleConnections = tvhPool.setdefault(response.tvhNetloc, [])
+            if len(tvhIdleConnections) < tvhPoolSize:
+                tvhIdleConnections.append(response.tvhConnection)
+                return
+        finally:
+            Thread.ReleaseLock('tvhPool')
+
+    response.close()
+    response.tvhConnection.close()
+
+
+# Gets an idle connection to Tvheadend from the pool or opens a new one
+def tvhConnection(urlScheme, urlNetloc):
+    Thread.AcquireLock('tvhPool')
+    try:
+        tvhIdleConnections = tvhPool.get((urlScheme, urlNetloc))
+        if tvhIdleConnections:
+            tvhPoolStats['hits'] += 1
+            return tvhIdleConnections.pop(), True
+
+        tvhPoolStats['misses'] += 1
+
+    finally:
+        Thread.ReleaseLock('tvhPool')
+
+    # Certificates are verified unless self-signed certificates are allowed in the preferences
+    if urlScheme == 'https':
+        if Prefs['prefUnverifiedSSL']:
+            return httplib.HTTPSConnection(urlNetloc, timeout=tvhTimeout, context=unverifiedSSL), False
+        return httplib.HTTPSConnection(urlNetloc, timeout=tvhTimeout, context=verifiedSSL), False
+    else:
+        return httplib.HTTPConnection(urlNetloc, timeout=tvhTimeout), False
+
+
+# Closes all idle connections to Tvheadend
+def tvhCloseConnections():
+    Thread.AcquireLock('tvhPool')
+    try:
+        for tvhIdleConnections in tvhPool.values():
+            for connection in tvhIdleConnections:
+                connection.close()
+        tvhPool.clear()
+    finally:
+        Thread.ReleaseLock('tvhPool')
+
+
+# Reads a Tvheadend response in chunks
+def tvhChunks(url, chunkSize):
+    response = tvhOpen(url)
+    try:
+        while True:
+            chunk = response.read(chunkSize)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        tvhRelease(response)
+
+
+# Reads a complete Tvheadend response
+def tvhRead(url):
+    response = tvhOpen(url)
+    try:
+        return response.read()
+    finally:
+        tvhRelease(response)
+
+
+# Sets the Tvheadend authorization from an HTTP Basic or Digest authentication challenge
+def tvhAuthChallenge(tvhChallenge):
+    if not tvhChallenge:
+        return None
+
+    tvhAuthUser = Prefs['tvhUser'].encode('utf-8')
+    tvhAuthPass = (Prefs['tvhPass'] or '').encode('utf-8')
+
+    if tvhChallenge.startswith('Basic'):
+        return {
+            'type': 'Basic',
+            'header': 'Basic ' + base64.b64encode(tvhAuthUser + ':' + tvhAuthPass)}
+
+    tvhChallengeValues = dict((m.group(1).lower(), m.group(3) if m.group(3) is not None else m.group(4))
+        for m in re.finditer(r'(\w+)=("([^"]*)"|([^,\s]*))', tvhChallenge))
+
+    return {
+        'type': 'Digest',
+        'user': tvhAuthUser,
+        'realm': tvhChallengeValues.get('realm', ''),
+        'nonce': tvhChallengeValues.get('nonce', ''),
+        'opaque': tvhChallengeValues.get('opaque'),
+        'qop': tvhChallengeValues.get('qop'),
+        'ha1': Hash.MD5(tvhAuthUser + ':' + tvhChallengeValues.get('realm', '') + ':' + tvhAuthPass),
+        'nc': 0}
+
+
+# Builds the Authorization header for a request, reusing the cached Digest nonce
+def tvhAuthHeader(method, urlPath):
+    auth = tvhAuth
+    if auth is None:
+        return None
+
+    if auth['type'] == 'Basic':
+        return auth['header']
+
+    ha2 = Hash.MD5(method + ':' + urlPath)
+
+    if auth['qop']:
+        Thread.AcquireLock('tvhAuth')
+        try:
+            auth['nc'] += 1
+            nonceCount = '%08x' % auth['nc']
+        finally:
+            Thread.ReleaseLock('tvhAuth')
+
+        cnonce = Hash.MD5(str(time.time()) + nonceCount)[:16]
+        digestResponse = Hash.MD5(':'.join((auth['ha1'], auth['nonce'], nonceCount, cnonce, 'auth', ha2)))
+        tvhAuthorization = 'Digest username="{}", realm="{}", nonce="{}", uri="{}", response="{}", qop=auth, nc={}, cnonce="{}"'.format(
+            auth['user'], auth['realm'], auth['nonce'], urlPath, digestResponse, nonceCount, cnonce)
+
+    else:
+        digestResponse = Hash.MD5(':'.join((auth['ha1'], auth['nonce'], ha2)))
+        tvhAuthorization = 'Digest username="{}", realm="{}", nonce="{}", uri="{}", response="{}"'.format(
+            auth['user'], auth['realm'], auth['nonce'], urlPath, digestResponse)
+
+    if auth['opaque']:
+        tvhAuthorization = tvhAuthorization + ', opaque="{}"'.format(auth['opaque'])
+
+    return tvhAuthorization
+
+
+# Times a block of code, adding the time to the latency histogram of the span and counting errors
+@contextlib.contextmanager
+def statsSpan(spanName):
+    spanStart = time.time()
+    spanError = False
+    try:
+        yield
+    except:
+        spanError = True
+        raise
+    finally:
+        statsRecord(spanName, time.time() - spanStart, spanError)
+
+
+# Adds a time to the latency histogram of a span
+def statsRecord(spanName, spanTime, spanError=False):
+    Thread.AcquireLock('stats')
+    try:
+        spanStats = statsSpans.get(spanName)
+        if spanStats is None:
+            spanStats = statsSpans[spanName] = {
+                'count': 0,
+                'errors': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'buckets': [0] * (len(statsBuckets) + 1)}
+
+        spanStats['count'] += 1
+        spanStats['total'] += spanTime
+        spanStats['max'] = max(spanStats['max'], spanTime)
+        spanStats['buckets'][bisect.bisect_left(statsBuckets, spanTime)] += 1
+        if spanError:
+            spanStats['errors'] += 1
+
+    finally:
+        Thread.ReleaseLock('stats')
+
+
+# Display timings, counters and cache sizes as JSON
+@route(PREFIX + '/stats')
+def stats():
+    Thread.AcquireLock('stats')
+    try:
+        spansReport = {}
+        for spanName, spanStats in statsSpans.items():
+            spanBuckets = {}
+            for bucketIndex, bucketCount in enumerate(spanStats['buckets']):
+                if bucketIndex < len(statsBuckets):
+                    spanBuckets[str(statsBuckets[bucketIndex])] = bucketCount
+                else:
+                    spanBuckets['+Inf'] = bucketCount
+
+            spansReport[spanName] = {
+                'count': spanStats['count'],
+                'errors': spanStats['errors'],
+                'total': round(spanStats['total'], 4),
+                'mean': round(spanStats['total'] / spanStats['count'], 4),
+                'max': round(spanStats['max'], 4),
+                'buckets': spanBuckets}
+
+        countersReport = dict(statsCounters)
+
+    finally:
+        Thread.ReleaseLock('stats')
+
+    for poolStat, poolCount in tvhPoolStats.items():
+        countersReport['tvhPool.' + poolStat] = poolCount
+
+    snapshot = tvhSnapshot
+    statsReport = {
+        'version': liveTVHVersion,
+        'uptime': round(time.time() - statsStartTime),
+        'spans': spansReport,
+        'counters': countersReport,
+        'sizes': {
+            'snapshot.version': snapshot['version'] if snapshot else 0,
+            'snapshot.age': round(time.time() - snapshot['time']) if snapshot else None,
+            'channels': len(snapshot['channels']) if snapshot else 0,
+            'epgEvents': len(snapshot['epg']['events']) if snapshot else 0,
+            'recordingsIndexed': len(recordingsIndex),
+            'pageCache': len(pageCache),
+            'metadataCache': len(metadataCache),
+            'imageCache.files': len(imageCacheFiles),
+            'imageCache.bytes': imageCacheBytes}}
+
+    return DataObject(JSON.StringFromObject(statsReport), 'application/json')
+
+
 # Builds the main menu
 @handler(PREFIX, TITLE)
 def MainMenu():
@@ -123,490 +545,1235 @@ def MainMenu():
         Log.Debug('Platform: ' + str(Client.Platform))
         Log.Debug('OS: ' + str(Platform.OS) + ' ' + str(Platform.CPU))
 
-    # Requests channel data from Tvheadend
-    tvhChannelsData = None
-    tvhChannelsURL = str(tvhAddress) + '/api/channel/grid?start=0&limit=100000'
+    return channels()
+
+
+# Retrieves channel, tag, recordings and EPG data from Tvheadend and publishes it as a new snapshot
+def refreshSnapshot(forceRefresh=False):
+    global tvhSnapshot
+
+    if not tvhReachable:
+        return
+
+    # Only one refresh runs at a time - a request waiting on the lock is served by the refresh it waited for,
+    # unless the refresh is forced to pick up data received after a previous refresh
+    snapshotVersion = tvhSnapshot['version'] if tvhSnapshot else 0
+    Thread.AcquireLock('refreshSnapshot')
+    try:
+        if tvhSnapshot and tvhSnapshot['version'] != snapshotVersion:
+            if not forceRefresh:
+                return
+            snapshotVersion = tvhSnapshot['version']
+
+        with statsSpan('snapshot'):
+            snapshot = buildSnapshot(snapshotVersion + 1)
+        if snapshot:
+            tvhSnapshot = snapshot
+            Log.Info('Tvheadend data updated, snapshot version: ' + str(snapshot['version']))
+            Log.Info('Tvheadend connections reused: {}, opened: {}, authentication challenges: {}'.format(
+                tvhPoolStats['hits'], tvhPoolStats['misses'], tvhPoolStats['challenges']))
+
+    finally:
+        Thread.ReleaseLock('refreshSnapshot')
+
 
-    if tvhReachable:
+# Refreshes the snapshot in the background so menus do not wait on Tvheadend
+def snapshotRefresher():
+    while True:
         try:
-            tvhChannelsData = JSON.ObjectFromString(urllib2.urlopen(tvhChannelsURL).read())
+            refreshSnapshot()
         except Exception as e:
-            Log.Critical('Error retrieving Tvheadend channel data: ' + str(e))
+            Log.Warn('Error updating Tvheadend data: ' + str(e))
 
-    # Displays an error message to clients if Tvheadend is malfunctional
-    if tvhChannelsData is None:
-        errorContainer = ObjectContainer(title1=TITLE, no_cache=True)
-        errorContainer.add(DirectoryObject(title=L('channelsUnavailable')))
-        return errorContainer
+        saveMetadataCache()
+        saveImageCache()
+        Thread.Sleep(snapshotRefreshInterval)
+
+
+# Returns the current snapshot, waiting for the first one if the background refresh has not finished yet
+def currentSnapshot():
+    if tvhSnapshot is None:
+        refreshSnapshot()
 
-    # Requests and sets channel tags from Tvheadend
-    # Tags are used as a manual method to identify video/audio attributes for each channel
+    return tvhSnapshot
+
+
+# Builds a snapshot of Tvheadend data - snapshots are not modified after they are published
+def buildSnapshot(snapshotVersion):
+    previousSnapshot = tvhSnapshot
+
+    # Requests channel, tag, recordings and EPG data from Tvheadend at the same time
+    snapshotResults = snapshotFetch({
+        'channels': snapshotChannels,
+        'tags': snapshotTags,
+        'recordings': snapshotRecordings,
+        'epg': syncEPG})
+
+    # Keeps the current snapshot if Tvheadend is malfunctional
+    tvhChannelsEntries = snapshotResults.get('channels')
+    if tvhChannelsEntries is None:
+        return None
+
+    # Uses data from the current snapshot for requests that did not finish in time
+    if 'tags' in snapshotResults:
+        tvhTagClasses = snapshotResults['tags']
+    elif previousSnapshot:
+        tvhTagClasses = previousSnapshot['tags']
+    else:
+        tvhTagClasses = {}
+
+    if 'recordings' in snapshotResults:
+        tvhRecordingsCount = snapshotResults['recordings']
+    elif previousSnapshot:
+        tvhRecordingsCount = previousSnapshot['recordingsCount']
+    else:
+        tvhRecordingsCount = None
+
+    # Index the EPG by channel and event
+    if 'epg' in snapshotResults:
+        with statsSpan('snapshot.epgIndex'):
+            tvhEPGStore = epgStore(epgEvents.values())
+    elif previousSnapshot:
+        tvhEPGStore = previousSnapshot['epg']
+    else:
+        tvhEPGStore = epgStore([])
+
+    # Sort channels by number for pagination and channel number searches
+    tvhChannels = tuple(sorted(tvhChannelsEntries, key=lambda c: (channelNumber(c), c.get('name') or '')))
+
+    # Index channels by uuid with their video/audio attributes, and build the playback URLs for each channel
+    tvhChannelIndex = {}
+    tvhPlaybackURLs = {}
+    for tvhChannel in tvhChannels:
+        tvhChannelIndex[tvhChannel['uuid']] = (tvhChannel, channelAttributes(tvhTagClasses, tvhChannel.get('tags')))
+        streamURL = '/stream/channel/' + str(tvhChannel['uuid'])
+        tvhPlaybackURLs[streamURL] = buildPlaybackURL(streamURL)
+
+    return {
+        'version': snapshotVersion,
+        'time': time.time(),
+        'channels': tvhChannels,
+        'channelNumbers': tuple(channelNumber(c) for c in tvhChannels),
+        'channelIndex': tvhChannelIndex,
+        'playbackURLs': tvhPlaybackURLs,
+        'tags': tvhTagClasses,
+        'recordingsCount': tvhRecordingsCount,
+        'epg': tvhEPGStore}
+
+
+# Runs the requests for a snapshot at the same time, returning the results of the requests that finished within
+# snapshotFetchTimeout - requests that did not finish are left out and used for another snapshot when they finish,
+# and requests still running from a previous snapshot are not started again
+def snapshotFetch(snapshotTasks):
+    fetchLock = Thread.Lock()
+    fetchDone = Thread.Event()
+    fetchResults = {}
+    fetchRemaining = [0]
+    fetchLate = [False]
+
+    def fetchWorker(taskName, task):
+        try:
+            with statsSpan('snapshot.' + taskName):
+                taskResult = task()
+        except Exception as e:
+            Log.Warn('Error retrieving Tvheadend ' + taskName + ' data: ' + str(e))
+            taskResult = None
+
+        with fetchLock:
+            Thread.AcquireLock('snapshotFetches')
+            try:
+                snapshotFetches.discard(taskName)
+
+                # Keep results received too late for the next snapshot
+                if fetchLate[0]:
+                    Log.Info('Tvheadend ' + taskName + ' data received after ' + str(snapshotFetchTimeout) + ' seconds, updating the snapshot')
+                    snapshotLateResults[taskName] = taskResult
+                    Thread.Create(refreshSnapshot, forceRefresh=True)
+                    return
+
+            finally:
+                Thread.ReleaseLock('snapshotFetches')
+
+            fetchResults[taskName] = taskResult
+            fetchRemaining[0] -= 1
+            if fetchRemaining[0] == 0:
+                fetchDone.set()
+
+    fetchTasks = []
+    Thread.AcquireLock('snapshotFetches')
+    try:
+        for taskName, task in snapshotTasks.items():
+            if taskName in snapshotLateResults:
+                fetchResults[taskName] = snapshotLateResults.pop(taskName)
+                continue
+
+            if taskName in snapshotFetches:
+                Log.Info('Tvheadend ' + taskName + ' data from the previous update has not been received yet')
+                continue
+
+            snapshotFetches.add(taskName)
+            fetchTasks.append((taskName, task))
+
+    finally:
+        Thread.ReleaseLock('snapshotFetches')
+
+    # Workers are started after releasing snapshotFetches, as workers hold fetchLock while acquiring it
+    fetchRemaining[0] = len(fetchTasks)
+    if not fetchTasks:
+        fetchDone.set()
+
+    for taskName, task in fetchTasks:
+        Thread.Create(fetchWorker, taskName=taskName, task=task)
+
+    if not fetchDone.wait(snapshotFetchTimeout):
+        Log.Warn('Tvheadend data was not received within ' + str(snapshotFetchTimeout) + ' seconds, continuing without it')
+
+    with fetchLock:
+        fetchLate[0] = True
+        return dict(fetchResults)
+
+
+# Requests channel data from Tvheadend
+def snapshotChannels():
+    tvhChannelsURL = str(tvhAddress) + '/api/channel/grid?start=0&limit=100000'
+
+    try:
+        return JSON.ObjectFromString(tvhRead(tvhChannelsURL))['entries']
+    except Exception as e:
+        Log.Critical('Error retrieving Tvheadend channel data: ' + str(e))
+        return None
+
+
+# Requests and classifies channel tags from Tvheadend
+# Tags are used as a manual method to identify video/audio attributes for each channel
+def snapshotTags():
     tvhTagsData = None
     tvhTagsURL = str(tvhAddress) + '/api/channeltag/grid?start=0&limit=100000'
 
     try:
-        tvhTagsData = JSON.ObjectFromString(urllib2.urlopen(tvhTagsURL).read())
+        tvhTagsData = JSON.ObjectFromString(tvhRead(tvhTagsURL))
         if debug: Log.Debug('tvhTagsData: ' + str(tvhTagsData))
     except Exception as e:
         Log.Warn('Error retrieving Tvheadend channel tags data: ' + str(e))
 
-    tvhVideoTags = {}
-    tvhAudioTags = {}
-    tvhStreamTypeTags = {}
-    tvhResolutionTags = {}
+    tvhTagClasses = {}
     try:
         if tvhTagsData:
             for tvhTagEntry in tvhTagsData['entries']:
+                tagClass = tagAttributes(tvhTagEntry['name'])
+                if any(tagClass):
+                    tvhTagClasses[tvhTagEntry['uuid']] = tagClass
 
-                # Set video tags
-                if 'h264' in tvhTagEntry['name'].lower():
-                    tvhVideoTags.setdefault('h264', []).append(tvhTagEntry['uuid'])
+    except Exception as e:
+        Log.Warn('Error parsing Tvheadend channel tags data: ' + str(e))
 
-                elif 'mpeg2' in tvhTagEntry['name'].lower():
-                    tvhVideoTags.setdefault('mpeg2video', []).append(tvhTagEntry['uuid'])
+    return tvhTagClasses
 
-                elif 'hevc' in tvhTagEntry['name'].lower():
-                    tvhVideoTags.setdefault('hevc', []).append(tvhTagEntry['uuid'])
 
-                elif 'vp8' in tvhTagEntry['name'].lower():
-                    tvhVideoTags.setdefault('vp8', []).append(tvhTagEntry['uuid'])
+# Requests the number of recordings and synchronizes the recordings search index
+def snapshotRecordings():
+    tvhRecordingsCount = None
+    try:
+        tvhRecordingsCount = recordingsCount()
+    except Exception as e:
+        Log.Warn('Error retrieving Tvheadend recordings data: ' + str(e))
 
-                elif 'vp9' in tvhTagEntry['name'].lower():
-                    tvhVideoTags.setdefault('vp9', []).append(tvhTagEntry['uuid'])
+    if tvhRecordingsCount is not None:
+        syncRecordings(tvhRecordingsCount)
 
-                # Set audio tags
-                if 'aac-latm' in tvhTagEntry['name'].lower():
-                    tvhAudioTags.setdefault('aac-latm', []).append(tvhTagEntry['uuid'])
+    return tvhRecordingsCount
 
-                elif 'aac' in tvhTagEntry['name'].lower():
-                    tvhAudioTags.setdefault('aac', []).append(tvhTagEntry['uuid'])
 
-                elif 'eac3' in tvhTagEntry['name'].lower():
-                    tvhAudioTags.setdefault('eac3', []).append(tvhTagEntry['uuid'])
+# Synchronizes EPG events from now until the end of the EPG window with the events kept from previous updates
+# Only events entering the window are requested, with a periodic full update of the window to pick up EPG changes
+def syncEPG():
+    global epgEvents
+    global epgSyncedUntil
+    global epgFullSyncTime
 
-                elif 'ac3' in tvhTagEntry['name'].lower():
-                    tvhAudioTags.setdefault('ac3', []).append(tvhTagEntry['uuid'])
+    now = int(time.time())
+    epgWindowEnd = now + max(epgWindowHours, int(Prefs['prefEPGCount'])) * 3600
+    epgServer = tvhServer # Events received after switching Tvheadend servers are discarded
 
-                elif 'mp2' in tvhTagEntry['name'].lower():
-                    tvhAudioTags.setdefault('mp2', []).append(tvhTagEntry['uuid'])
+    if not epgEvents or now - epgFullSyncTime >= epgFullSyncInterval:
+        epgFilter = [
+            {'field': 'stop', 'type': 'numeric', 'value': now, 'comparison': 'gt'},
+            {'field': 'start', 'type': 'numeric', 'value': epgWindowEnd, 'comparison': 'lt'}]
 
-                elif 'mp3' in tvhTagEntry['name'].lower():
-                    tvhAudioTags.setdefault('mp3', []).append(tvhTagEntry['uuid'])
+        tvhEPGEntries = epgWindow(epgFilter, epgWindowEnd)
+        if tvhEPGEntries is None or tvhServer != epgServer:
+            return False
 
-                elif 'vorbis' in tvhTagEntry['name'].lower():
-                    tvhAudioTags.setdefault('vorbis', []).append(tvhTagEntry['uuid'])
+        epgEvents = {}
+        epgFullSyncTime = now
 
-                # Set stream type tags
-                if 'radio' in tvhTagEntry['name'].lower():
-                    tvhStreamTypeTags.setdefault('radio', []).append(tvhTagEntry['uuid'])
+    else:
+        epgFilter = [
+            {'field': 'start', 'type': 'numeric', 'value': epgSyncedUntil - 1, 'comparison': 'gt'},
+            {'field': 'start', 'type': 'numeric', 'value': epgWindowEnd, 'comparison': 'lt'}]
 
+        tvhEPGEntries = epgWindow(epgFilter, epgWindowEnd)
+        if tvhEPGEntries is None or tvhServer != epgServer:
+            return False
 
-                # Set resolution type tags
-                if 'hdtv' in tvhTagEntry['name'].lower() or '1080p' in tvhTagEntry['name'].lower():
-                    tvhResolutionTags.setdefault('1080p', []).append(tvhTagEntry['uuid'])
+    for tvhEPGEntry in tvhEPGEntries:
+        epgEvents[tvhEPGEntry['eventId']] = tvhEPGEntry
 
-                elif '720p' in tvhTagEntry['name'].lower():
-                    tvhResolutionTags.setdefault('720p', []).append(tvhTagEntry['uuid'])
+    epgSyncedUntil = epgWindowEnd
 
-                elif 'sdtv' in tvhTagEntry['name'].lower() or '576p' in tvhTagEntry['name'].lower():
-                    tvhResolutionTags.setdefault('576p', []).append(tvhTagEntry['uuid'])
+    # Remove shows that have ended
+    for eventId, tvhEPGEntry in epgEvents.items():
+        if int(tvhEPGEntry['stop']) <= now:
+            del epgEvents[eventId]
 
+    if debug: Log.Debug('EPG events: ' + str(len(epgEvents)) + ', received: ' + str(len(tvhEPGEntries)))
+    return True
 
-    except Exception as e:
-        Log.Warn('Error parsing Tvheadend channel tags data: ' + str(e))
 
-    # Request recordings data as UTF-8 with fallback to ISO-8859-1
-    tvhRecordingsData = None
-    tvhRecordingsURL = str(tvhAddress) + '/api/dvr/entry/grid_finished'
-    recordingsUTF8Encoding = True
+# Requests EPG events matching a filter from Tvheadend in pages sorted by start time, up to the end of the EPG window
+# The page size is learned from the average size of events received and kept for the next update - if a page
+# breaks off partway, the events received are kept and the page continues from the next event in pages half the
+# size, with the maximum page size lowered to that size and raised again by a quarter for each page received
+# Errors before any data is received, such as HTTP errors, refused connections and timeouts, fail the window
+def epgWindow(epgFilter, epgWindowEnd):
+    global epgPageLimit
+    global epgPageCeiling
+
+    tvhEPGEntries = []
+    epgStart = 0
+    pageLimit = min(epgPageLimit, epgPageCeiling)
 
     while True:
-        try:
-            if recordingsUTF8Encoding:
-                recordingsEncoding = 'utf-8'
-            else:
-                recordingsEncoding = 'latin-1'
+        tvhEPGURL = '{}/api/epg/events/grid?start={}&limit={}&sort=start&dir=ASC&filter={}'.format(
+            tvhAddress, epgStart, pageLimit, String.Quote(JSON.StringFromObject(epgFilter)))
 
-            rawRecordingsData = urllib2.urlopen(tvhRecordingsURL).read()
-            rawRecordingsData = re.sub(r'[\x00-\x1f]', '', rawRecordingsData) # Strip control characters from recordings data (yep, this has actually happened)
-            tvhRecordingsData = JSON.ObjectFromString(rawRecordingsData, encoding=recordingsEncoding, max_size=20971520)
-            if tvhRecordingsData: break
+        epgPageCount = 0
+        epgEntryStart = 0
+        gridStats = {'bytes': 0}
+
+        try:
+            for tvhEPGEntry in tvhGrid(tvhEPGURL, 'EPG', gridStats):
+                epgPageCount += 1
+                try:
+                    epgEntryStart = int(tvhEPGEntry['start'])
+                    if epgEntryStart < epgWindowEnd:
+                        tvhEPGEntries.append(tvhEPGEntry)
+                except (KeyError, TypeError, ValueError): pass
 
         except Exception as e:
-            if recordingsUTF8Encoding:
-                Log.Warn('Unable to retrieve Tvheadend recordings data as UTF-8, falling back to ISO-8859-1: ' + str(e))
-                recordingsUTF8Encoding = False
-            else:
-                Log.Warn('Error retrieving Tvheadend recordings data: ' + str(e))
-                break
+            if isinstance(e, urllib2.HTTPError) or not gridStats['bytes'] or pageLimit <= epgPageMinimum:
+                return None
+
+            epgStart = epgStart + epgPageCount
+            pageLimit = max(epgPageMinimum, (pageLimit - epgPageCount) // 2)
+            epgPageCeiling = pageLimit
+            statsCounters['epg.pageRetries'] += 1
+            Log.Warn('Error retrieving Tvheadend EPG data, continuing from event ' + str(epgStart) + ' in pages of ' + str(pageLimit) + ' events: ' + str(e))
+            continue
+
+        epgPageCeiling = min(epgPageMaximum, max(epgPageCeiling, pageLimit) * 5 // 4)
 
-    if int(tvhRecordingsData['total']) == 0:
-        tvhRecordingsData = None
+        # Stop at the last page or once the page reaches the end of the EPG window
+        if epgPageCount < pageLimit or epgEntryStart >= epgWindowEnd:
+            break
+
+        epgStart = epgStart + epgPageCount
+
+        # Size the next page from the average size of the events in this page
+        if epgPageCount >= epgPageMinimum:
+            eventBytes = max(1, gridStats['bytes'] // epgPageCount)
+            pageLimit = max(epgPageMinimum, min(epgPageCeiling, epgPageBytes // eventBytes))
+            epgPageLimit = pageLimit
+
+    return tvhEPGEntries
+
+
+# Requests grid entries from Tvheadend, decoding each entry as UTF-8 with fallback to ISO-8859-1 for that entry only
+# Fields of an ISO-8859-1 entry that are valid UTF-8 are repaired back to UTF-8, and grids with ISO-8859-1 fields
+# are decoded as ISO-8859-1 from the start in the next request instead of attempting UTF-8 for each entry
+def tvhGrid(url, gridName, gridStats=None):
+    gridEncoding = tvhGridEncodings.get(gridName, 'utf-8')
+    latin1Count = 0
 
-    # Set the number of EPG items to retrieve
-    tvhEPGData = None
     try:
-        if int(Prefs['prefEPGCount']) == 0:
-            epgLimit = int(tvhChannelsData['total']) * 4
-        else:
-            epgLimit = int(tvhChannelsData['total']) * int(Prefs['prefEPGCount']) * 4
+        for gridData in tvhGridEntries(url, gridStats):
+            gridEntry = None
+            if gridEncoding == 'utf-8':
+                try:
+                    gridEntry = JSON.ObjectFromString(gridData, encoding='utf-8')
+                except Exception: pass
 
-        if epgLimit > 20000: epgLimit = 20000
+            if gridEntry is None:
+                gridEntry, latin1Fields = tvhGridRepair(JSON.ObjectFromString(gridData, encoding='latin-1'))
+                if latin1Fields:
+                    latin1Count += 1
 
-    except Exception as e:
-        Log.Warn('Error calculating the EPG limit: ' + str(e))
-        epgLimit = 20000
+            yield gridEntry
 
-    # Request EPG data as UTF-8 with fallback to ISO-8859-1
-    epgLoopLimit = epgLimit
-    epgUTF8Encoding = True
+    except Exception as e:
+        Log.Warn('Error retrieving Tvheadend ' + gridName + ' data: ' + str(e))
+        raise
 
-    while True:
+    if latin1Count:
+        if gridEncoding == 'utf-8':
+            Log.Info('Tvheadend ' + gridName + ' data contains ISO-8859-1 characters in ' + str(latin1Count) + ' entries')
+        tvhGridEncodings[gridName] = 'latin-1'
+    else:
+        tvhGridEncodings[gridName] = 'utf-8'
+
+
+# Decodes the strings of a grid entry decoded as ISO-8859-1 as UTF-8 where they are valid UTF-8
+# Returns the entry and whether any strings were kept as ISO-8859-1
+def tvhGridRepair(gridValue):
+    if isinstance(gridValue, dict):
+        latin1Fields = False
+        for gridKey, gridField in gridValue.items():
+            gridValue[gridKey], latin1Field = tvhGridRepair(gridField)
+            latin1Fields = latin1Fields or latin1Field
+        return gridValue, latin1Fields
+
+    elif isinstance(gridValue, list):
+        latin1Fields = False
+        for gridIndex, gridField in enumerate(gridValue):
+            gridValue[gridIndex], latin1Field = tvhGridRepair(gridField)
+            latin1Fields = latin1Fields or latin1Field
+        return gridValue, latin1Fields
+
+    elif isinstance(gridValue, unicode):
         try:
-            tvhEPGURL = str(tvhAddress) + '/api/epg/events/grid?start=0&limit=' + str(epgLoopLimit)
+            return gridValue.encode('latin-1').decode('utf-8'), False
+        except UnicodeEncodeError:
+            return gridValue, False
+        except UnicodeDecodeError:
+            return gridValue, True
+
+    return gridValue, False
+
+
+# Reads the entries of a Tvheadend grid response one at a time as the response is received, returning the JSON data
+# of each entry - only the current entry is kept in memory instead of the whole response, so there is no limit on
+# the response size
+tvhGridTokens = re.compile(r'[\\"{}\[\]]')
+tvhGridControlCharacters = re.compile(r'[\x00-\x1f]')
+
+def tvhGridEntries(url, gridStats=None):
+    gridBuffer = ''
+    gridDepth = 0
+    gridKey = None
+    keyStart = None
+    entriesList = False
+    entryStart = None
+    inString = False
+    escapedPos = -1
+
+    for chunk in tvhChunks(url, gridChunkSize):
+        if gridStats is not None:
+            gridStats['bytes'] += len(chunk)
+
+        scanStart = len(gridBuffer)
+        gridBuffer = gridBuffer + tvhGridControlCharacters.sub('', chunk) # Strip control characters from grid data (yep, this has actually happened)
+
+        for token in tvhGridTokens.finditer(gridBuffer, scanStart):
+            tokenPos = token.start()
+            tokenChar = token.group()
+
+            # Skip string contents, including escaped quotes
+            if inString:
+                if tokenPos == escapedPos:
+                    continue
+                elif tokenChar == '\\':
+                    escapedPos = tokenPos + 1
+                elif tokenChar == '"':
+                    inString = False
+                    if gridDepth == 1:
+                        gridKey = gridBuffer[keyStart:tokenPos]
+
+            elif tokenChar == '"':
+                inString = True
+                keyStart = tokenPos + 1
+
+            elif tokenChar == '{' or tokenChar == '[':
+                gridDepth += 1
+                if gridDepth == 2 and tokenChar == '[' and gridKey == 'entries':
+                    entriesList = True
+                elif gridDepth == 3 and entriesList and tokenChar == '{':
+                    entryStart = tokenPos
 
-            if epgUTF8Encoding:
-                epgEncoding = 'utf-8'
             else:
-                epgEncoding = 'latin-1'
+                if gridDepth == 3 and entriesList and tokenChar == '}':
+                    yield gridBuffer[entryStart:tokenPos + 1]
+                    entryStart = None
+                elif gridDepth == 2 and entriesList:
+                    entriesList = False
+                gridDepth -= 1
+
+        # Keep only the unfinished entry or top level key in the buffer
+        if entryStart is not None:
+            bufferStart = entryStart
+        elif inString and gridDepth == 1:
+            bufferStart = keyStart - 1
+        else:
+            bufferStart = len(gridBuffer)
+
+        gridBuffer = gridBuffer[bufferStart:]
+        escapedPos = escapedPos - bufferStart
+        if entryStart is not None:
+            entryStart = entryStart - bufferStart
+        if keyStart is not None:
+            keyStart = keyStart - bufferStart
+
+    if gridDepth != 0 or inString:
+        raise ValueError('Incomplete grid data')
+
+
+# Channel tag rules for video codecs, audio codecs, stream types and resolutions
+# Tags are matched by name, and the first matching rule for each attribute is used
+tvhTagRules = (
+    (('h264', 'h264'), ('mpeg2', 'mpeg2video'), ('hevc', 'hevc'), ('vp8', 'vp8'), ('vp9', 'vp9')),
+    (('aac-latm', 'aac-latm'), ('aac', 'aac'), ('eac3', 'eac3'), ('ac3', 'ac3'), ('mp2', 'mp2'), ('mp3', 'mp3'), ('vorbis', 'vorbis')),
+    (('radio', 'radio'),),
+    (('hdtv', '1080p'), ('1080p', '1080p'), ('720p', '720p'), ('sdtv', '576p'), ('576p', '576p')))
+
+# Classifies a channel tag name as a (video, audio, stream type, resolution) tuple
+def tagAttributes(tagName):
+    tagName = tagName.lower()
+    tagClass = []
+
+    for tagRules in tvhTagRules:
+        tagValue = None
+        for tagMatch, tagRuleValue in tagRules:
+            if tagMatch in tagName:
+                tagValue = tagRuleValue
+                break
+        tagClass.append(tagValue)
 
-            rawEPGData = urllib2.urlopen(tvhEPGURL).read()
-            rawEPGData = re.sub(r'[\x00-\x1f]', '', rawEPGData) # Strip control characters from EPG data (yep, this has actually happened)
-            tvhEPGData = JSON.ObjectFromString(rawEPGData, encoding=epgEncoding, max_size=20971520)
-            if tvhEPGData: break
+    return tuple(tagClass)
 
-        except Exception as e:
-            if 'Data of size' in str(e):
-                epgLoopLimit = epgLoopLimit - 1000
-                if epgLoopLimit > 0:
-                    Log.Warn('Tvheadend EPG data exceeded the data size limit, reducing the request: ' + str(e))
-                else:
-                    Log.Warn('Unable to retrieve Tvheadend EPG data within the data size limit.')
-                    break
 
-            else:
-                if epgUTF8Encoding:
-                    Log.Warn('Unable to retrieve Tvheadend EPG data as UTF-8, falling back to ISO-8859-1: ' + str(e))
-                    epgUTF8Encoding = False
-                else:
-                    Log.Warn('Error retrieving Tvheadend EPG data: ' + str(e))
-                    break
+# Sets channel attributes from the classified channel tags, with later tags taking precedence
+def channelAttributes(tvhTagClasses, tvhChannelTags):
+    streamAttributes = [None, None, None, None]
 
-    # Build the channel list
-    startCount = 0
+    for tvhChannelTagEntry in tvhChannelTags or ():
+        tagClass = tvhTagClasses.get(tvhChannelTagEntry)
+        if tagClass:
+            for attributeIndex, attributeValue in enumerate(tagClass):
+                if attributeValue:
+                    streamAttributes[attributeIndex] = attributeValue
 
-    @route(PREFIX + '/channels', startCount=int)
-    def channels(startCount=0, art=ART):
-        pageContainer = ObjectContainer(title1=TITLE, no_cache=True)
-        nextStartCount = startCount + int(Prefs['prefPageCount'])
+    return tuple(streamAttributes)
 
-        if tvhChannelsData:
 
-            # Set metadata for each channel and add to the main menu
-            for tvhChannel in sorted(tvhChannelsData['entries'], key=lambda t: float(t['number']))[startCount:nextStartCount]:
+# Build the channel list
+@route(PREFIX + '/channels', startCount=int)
+def channels(startCount=0, art=ART):
+    snapshot = currentSnapshot()
 
-                # Set channel metadata using Tvheadend channel info
-                try:
-                    title = tvhChannel['name']
-                except:
-                    title = None
+    # Displays an error message to clients if Tvheadend is malfunctional
+    if snapshot is None:
+        errorContainer = ObjectContainer(title1=TITLE, no_cache=True)
+        errorContainer.add(DirectoryObject(title=L('channelsUnavailable')))
+        return errorContainer
 
-                if Prefs['prefChannelNumbers']:
-                    if title:
-                        title = str(tvhChannel['number']) + ' ' + title
-                    else:
-                        title = str(tvhChannel['number'])
-
-                uuid = tvhChannel['uuid']
-                streamURL = '/stream/channel/' + str(uuid)
-                streamVideo = None
-                streamAudio = None
-                streamType = None
-                streamResolution = None
-                thumb = None
-                fallbackThumb = None
-                epgThumb = None
-                art = R(ART)
-                summary = None
-                tagline = None
-                source_title = None
-                year = None
-                rating = None
-                content_rating = None
-                genres = ' '
-                artist = None
-
-                # Set channel attributes using Tvheadend channel tags
-                try:
-                    for tvhChannelTagEntry in tvhChannel['tags']:
-
-                        for tvhVideoTag, tvhVideoTagUUID in tvhVideoTags.items():
-                            if tvhChannelTagEntry in tvhVideoTagUUID:
-                                streamVideo = tvhVideoTag
-
-                        for tvhAudioTag, tvhAudioTagUUID in tvhAudioTags.items():
-                            if tvhChannelTagEntry in tvhAudioTagUUID:
-                                streamAudio = tvhAudioTag
-
-                        for tvhStreamTypeTag, tvhStreamTypeTagUUID in tvhStreamTypeTags.items():
-                            if tvhChannelTagEntry in tvhStreamTypeTagUUID:
-                                streamType = tvhStreamTypeTag
-
-                        for tvhResolutionTag, tvhResolutionTagUUID in tvhResolutionTags.items():
-                            if tvhChannelTagEntry in tvhResolutionTagUUID:
-                                streamResolution = tvhResolutionTag
-                except: pass
-
-                # Set audio channel title metadata per client
-                if streamType == 'radio':
-                    if Client.Product == 'Plex Web':
-                        artist = title
-                        title = ' '
-                    else:
-                        title = title
-                        artist = ' '
-
-                # Set channel metadata using Tvheadend EPG info
-                if tvhEPGData:
-                    for tvhEPGEntry in tvhEPGData['entries']:
-                        if (
-                            time.time() < int(tvhEPGEntry['stop'])
-                            and tvhEPGEntry['channelUuid'] == uuid
-                            and time.time() >= int(tvhEPGEntry['start'])
-                            and tvhEPGEntry.get('title')):
-
-                            epgStart = int(tvhEPGEntry.get('start'))
-                            epgStop = int(tvhEPGEntry.get('stop'))
-                            epgSubtitle = tvhEPGEntry.get('subtitle')
-                            epgSummary = tvhEPGEntry.get('summary')
-                            epgDescription = tvhEPGEntry.get('description')
-
-                            epgDupedSubtitleSummary = False
-                            if epgSubtitle and epgSummary and epgSubtitle == epgSummary:
-                                epgDupedSubtitleSummary = True # Some EPG providers duplicate info in these fields
-
-                            # Set the show title
-                            title = title + ': ' + tvhEPGEntry['title']
-
-                            # Set times
-                            if Prefs['pref24Time']:
-                                startTime = time.strftime('%H:%M', time.localtime(epgStart))
-                                stopTime = time.strftime('%H:%M', time.localtime(epgStop))
-                            else:
-                                startTime = time.strftime('%I:%M%p', time.localtime(epgStart)).lstrip('0').lower()
-                                stopTime = time.strftime('%I:%M%p', time.localtime(epgStop)).lstrip('0').lower()
-
-                            # Set the titles and summary per client
-                            if Client.Product == 'Plex Web':
-                                title = title + '                                        ' # Force Plex Web to use the Details view by padding the title
-                                tagline = startTime + '-' + stopTime
-
-                                if epgDupedSubtitleSummary:
-                                    if epgDescription:
-                                        tagline = tagline + ': ' + epgSubtitle
-                                        summary = epgDescription + '\n'
-                                    else:
-                                        summary = epgSummary + '\n'
-                                else:
-                                    if epgSubtitle: tagline = tagline + ': ' + epgSubtitle
-                                    if epgSummary: summary = epgSummary + '\n'
-                                    if epgDescription: summary = epgDescription + '\n'
-
-                            elif Client.Product == 'Plex for Roku':
-                                source_title = startTime + '-' + stopTime
-
-                                if epgDupedSubtitleSummary:
-                                    if epgDescription:
-                                        source_title = source_title + ': ' + epgSubtitle
-                                        summary = epgDescription + '\n'
-                                    else:
-                                        summary = epgSummary + '\n'
-                                else:
-                                    if epgSubtitle: source_title = source_title + ': ' + epgSubtitle
-                                    if epgSummary: summary = epgSummary + '\n'
-                                    if epgDescription: summary = epgDescription + '\n'
-
-                            elif Client.Product == 'Plex for Android':
-                                source_title = startTime + '-' + stopTime
-                                summary = startTime + '-' + stopTime
-
-                                if epgDupedSubtitleSummary:
-                                    if epgDescription:
-                                        title = title + ' (' + epgSubtitle + ')'
-                                        summary = summary + ': ' + epgDescription + '\n'
-                                    else:
-                                        summary = summary + ': ' + epgSummary + '\n'
-                                else:
-                                    if epgSubtitle: title = title + ' (' + epgSubtitle + ')'
-                                    if epgSummary or epgDescription:
-                                        if epgSummary: summary = summary + ': ' + epgSummary + '\n'
-                                        if epgDescription: summary = summary + ': ' + epgDescription + '\n'
-                                    else:
-                                        summary = summary + '\n'
-
-                            else:
-                                summary = startTime + '-' + stopTime
-
-                                if epgDupedSubtitleSummary:
-                                    if epgDescription:
-                                        title = title + ' (' + epgSubtitle + ')'
-                                        summary = summary + ': ' + epgDescription + '\n'
-                                    else:
-                                        summary = summary + ': ' + epgSummary + '\n'
-                                else:
-                                    if epgSubtitle: title = title + ' (' + epgSubtitle + ')'
-                                    if epgSummary or epgDescription:
-                                        if epgSummary: summary = summary + ': ' + epgSummary + '\n'
-                                        if epgDescription: summary = summary + ': ' + epgDescription + '\n'
-                                    else:
-                                        summary = summary + '\n'
-
-                            # List upcoming titles on this channel in the summary by searching for shows
-                            # in the next number of hours or number of entries, whichever is greater
-                            if tvhEPGEntry.get('nextEventId'):
-                                nextEventID = tvhEPGEntry['nextEventId']
-                                epgCount = int(Prefs['prefEPGCount'])
-                                timeLimit = int(time.time()) + (int(Prefs['prefEPGCount'])*3600)
-                                nextEPGCount = 1
-                                nextEPGLoop = True
-                                while nextEPGLoop:
-                                    for nextEntry in tvhEPGData['entries']:
-                                        nextEntryStart = int(nextEntry['start'])
-                                        try:
-                                            if nextEntry['eventId'] == nextEventID and (nextEntryStart <= timeLimit or nextEPGCount <= epgCount):
-                                                if Prefs['pref24Time']:
-                                                    nextStartTime = time.strftime('%H:%M', time.localtime(nextEntryStart))
-                                                else:
-                                                    nextStartTime = time.strftime('%I:%M%p', time.localtime(nextEntryStart)).lstrip('0').lower()
-
-                                                if summary:
-                                                    summary = summary + nextStartTime + ': ' + nextEntry['title'] + '\n'
-                                                else:
-                                                    summary = nextStartTime + ': ' + nextEntry['title'] + '\n'
-
-                                                nextEventID = nextEntry['nextEventId']
-                                                nextEPGCount += 1
-                                                if nextEPGCount > epgCount and nextEntryStart > timeLimit:
-                                                    break
-
-                                            else:
-                                                nextEPGLoop = False
-
-                                        except KeyError: pass
-
-                            # Check if this title has a zap2it ID
-                            zap2itID = None
-                            try:
-                                if tvhEPGEntry.get('episodeUri'):
-                                    epgID=tvhEPGEntry['episodeUri'].split('/')[3].split('.')[0]
-                                    if epgID.startswith('MV') or epgID.startswith('EP') or epgID.startswith('SH'):
-                                        zap2itID = epgID
-                            except: pass
-
-                            # Find metadata for this title
-                            if Prefs['prefMetadata']:
-                                metadataResults = metadata(title=tvhEPGEntry['title'], zap2itID=zap2itID)
-                                if metadataResults['thumb']: thumb = metadataResults['thumb']
-                                if metadataResults['art']: art = metadataResults['art']
-                                if metadataResults['year']: year = int(metadataResults['year'])
-                                if metadataResults['rating']: rating = float(metadataResults['rating'])
-                                if metadataResults['content_rating']: content_rating = metadataResults['content_rating']
-                                if metadataResults['genres']: genres = metadataResults['genres']
-                                if metadataResults['zap2itMissingID'] and improveTheTVDB:
-                                    summary = metadataResults['zap2itMissingID'] + ' | ' + summary
-
-                            # Check the EPG entry for a thumbnail
-                            if tvhEPGEntry.get('image') and tvhEPGEntry['image'].startswith('http'):
-                                epgThumb = tvhEPGEntry['image']
-
-                # Use EPG thumbnails from Tvheadend if a thumbnail is not available from the metadata providers
-                if thumb is None and epgThumb:
-                    thumb = epgThumb
-
-                if fallbackThumb is None and epgThumb:
-                    fallbackThumb = epgThumb
-
-                # Use channel icons from Tvheadend if no other thumbnail is available
-                try:
-                    if thumb is None:
-                        if tvhChannel['icon_public_url'].startswith('imagecache'):
-                            thumb = '{}/{}'.format(tvhAddress, tvhChannel['icon_public_url'])
-                        elif tvhChannel['icon_public_url'].startswith('http'):
-                            thumb = tvhChannel['icon_public_url']
-
-                    if tvhChannel['icon_public_url'].startswith('imagecache'):
-                        fallbackThumb ='{}/{}'.format(tvhAddress, tvhChannel['icon_public_url'])
-                    elif tvhChannel['icon_public_url'].startswith('http'):
-                        fallbackThumb = tvhChannel['icon_public_url']
-
-                except: pass
-
-                # Set the channel object type - this determines if thumbnails are displayed as posters or video clips
-                # Plex for Roku only displays source_title for VideoClipObjects
-                if streamType == 'radio':
-                    channelType = 'TrackObject'
-                else:
-                    if Client.Product == 'Plex Home Theater':
-                        channelType = 'MovieObject'
-                    elif Client.Product == 'Plex for Roku' or not Prefs['prefMetadata']:
-                        channelType = 'VideoClipObject'
-                    else:
-                        channelType = 'MovieObject'
+    tvhChannels = snapshot['channels']
+
+    pageContainer = ObjectContainer(title1=TITLE, no_cache=True)
+    nextStartCount = startCount + int(Prefs['prefPageCount'])
+
+    if tvhChannels:
+        with statsSpan('render.channels'):
+            for channelItem in channelPage(snapshot, startCount, nextStartCount):
+                pageContainer.add(channel(**channelItem))
+
+        # Add recordings and preferences to the end of the channel list because several clients have display
+        # issues when these types of objects are at the beginning of the container
+        if len(tvhChannels) < int(Prefs['prefPageCount']):
+            pageContainer.add(
+                DirectoryObject(
+                    key=Callback(recordings),
+                    title=L('recordings'),
+                    thumb=R('recordings.png')))
+
+            if snapshot['epg']['events']:
+                pageContainer.add(DirectoryObject(key=Callback(guide), title=L('guide')))
 
-                # Build and add the channel to the main menu
+            pageContainer.add(PrefsObject(title=L('preferences')))
+
+        # Paginate the channel list
+        if len(tvhChannels) > nextStartCount:
+            pageContainer.add(NextPageObject(key=Callback(channels, startCount=nextStartCount), title=L('next'), thumb=R('next.png')))
+
+            # Add a channel number search and the guide to the first page of the channel list when paginated
+            if startCount == 0:
                 pageContainer.add(
-                    channel(
-                        channelType=channelType,
-                        title=title,
-                        streamURL=streamURL,
-                        streamVideo=streamVideo,
-                        streamAudio=streamAudio,
-                        streamResolution=streamResolution,
-                        thumb=thumb,
-                        fallbackThumb=fallbackThumb,
-                        art=art,
-                        summary=summary,
-                        tagline=tagline,
-                        source_title=source_title,
-                        year=year,
-                        rating=rating,
-                        content_rating=content_rating,
-                        genres=genres,
-                        artist=artist))
-
-            # Add recordings and preferences to the end of the channel list because several clients have display
-            # issues when these types of objects are at the beginning of the container
-            if len(tvhChannelsData['entries']) < int(Prefs['prefPageCount']):
+                    InputDirectoryObject(
+                        key=Callback(jumpToChannel),
+                        title=L('jumpToChannel'),
+                        prompt=L('jumpToChannelPrompt')))
+
+                if snapshot['epg']['events']:
+                    pageContainer.add(DirectoryObject(key=Callback(guide), title=L('guide')))
+
+            # Add recordings and preferences to the end of the first page of the channel list when paginated
+            if snapshot['recordingsCount'] and startCount == 0:
                 pageContainer.add(
                     DirectoryObject(
-                        key=Callback(
-                            recordings,
-                            tvhVideoTags=tvhVideoTags,
-                            tvhAudioTags=tvhAudioTags),
+                        key=Callback(recordings),
                         title=L('recordings'),
                         thumb=R('recordings.png')))
 
                 pageContainer.add(PrefsObject(title=L('preferences')))
 
-            # Paginate the channel list
-            if len(tvhChannelsData['entries']) > nextStartCount:
-                pageContainer.add(NextPageObject(key=Callback(channels, startCount=nextStartCount), title=L('next'), thumb=R('next.png')))
+    return pageContainer
 
-                # Add recordings and preferences to the end of the first page of the channel list when paginated
-                if tvhRecordingsData and startCount == 0:
-                    pageContainer.add(
-                        DirectoryObject(
-                            key=Callback(
-                                recordings,
-                                tvhVideoTags=tvhVideoTags,
-                                tvhAudioTags=tvhAudioTags),
-                            title=L('recordings'),
-                            thumb=R('recordings.png')))
 
-                    pageContainer.add(PrefsObject(title=L('preferences')))
+# Display the channel list starting from a channel number
+@route(PREFIX + '/jumptochannel')
+def jumpToChannel(query=None):
+    snapshot = currentSnapshot()
+    if snapshot is None or not snapshot['channels']:
+        return channels()
 
-        return pageContainer
-    return channels()
+    # Find the first channel with the number, or the next channel after it
+    channelIndex = bisect.bisect_left(snapshot['channelNumbers'], channelNumber({'number': str(query).strip()}))
+    return channels(startCount=min(channelIndex, len(snapshot['channels']) - 1))
+
+
+# Get the channel objects for a page of the channel list
+# Pages are reused for the same snapshot, client and preferences until the current show on one of their channels changes
+def channelPage(snapshot, startCount, nextStartCount):
+    pageKey = (
+        snapshot['version'],
+        Client.Product,
+        startCount,
+        nextStartCount,
+        Prefs['prefChannelNumbers'],
+        Prefs['pref24Time'],
+        Prefs['prefEPGCount'],
+        Prefs['prefMetadata'])
+
+    Thread.AcquireLock('pageCache')
+    try:
+        pageCacheEntry = pageCache.get(pageKey)
+        if pageCacheEntry and time.time() < pageCacheEntry[0]:
+            statsCounters['pageCache.hits'] += 1
+            return pageCacheEntry[1]
+
+        statsCounters['pageCache.misses'] += 1
+
+    finally:
+        Thread.ReleaseLock('pageCache')
+
+    pageExpires, pageItems = buildChannelPage(snapshot, startCount, nextStartCount)
+
+    # Pages with metadata searches still running are not cached so the results are displayed when found
+    if pageExpires:
+        Thread.AcquireLock('pageCache')
+        try:
+            now = time.time()
+            for cachedKey, cachedEntry in list(pageCache.items()):
+                if cachedKey[0] != snapshot['version'] or now >= cachedEntry[0]:
+                    del pageCache[cachedKey]
+
+            pageCache[pageKey] = (pageExpires, pageItems)
+            while len(pageCache) > pageCacheSize:
+                pageCache.popitem(last=False)
+
+        finally:
+            Thread.ReleaseLock('pageCache')
+
+    return pageItems
+
+
+# Build the channel objects for a page of the channel list, returning the time the page expires and the
+# arguments for channel() for each channel - the page does not expire if metadata was not found in time
+def buildChannelPage(snapshot, startCount, nextStartCount):
+    tvhEPGStore = snapshot['epg']
+    pageItems = []
+    pageExpires = time.time() + snapshotRefreshInterval
+    pageComplete = True
+
+    pageChannels = snapshot['channels'][startCount:nextStartCount]
+
+    # Find metadata for the current show on each channel of the page at the same time
+    metadataPage = {}
+    if Prefs['prefMetadata'] and tvhEPGStore:
+        metadataRequests = []
+        for tvhChannel in pageChannels:
+            tvhEPGEntry = epgNowPlaying(tvhEPGStore, tvhChannel['uuid'])
+            if tvhEPGEntry:
+                metadataRequests.append((tvhEPGEntry['title'], epgZap2itID(tvhEPGEntry)))
+
+        with statsSpan('metadata.batch'):
+            metadataPage = metadataBatch(metadataRequests)
+
+    # Set metadata for each channel of the page
+    for tvhChannel in pageChannels:
+
+        # Set channel metadata using Tvheadend channel info
+        try:
+            title = tvhChannel['name']
+        except:
+            title = None
+
+        if Prefs['prefChannelNumbers'] and tvhChannel.get('number') is not None:
+            if title:
+                title = str(tvhChannel['number']) + ' ' + title
+            else:
+                title = str(tvhChannel['number'])
+
+        uuid = tvhChannel['uuid']
+        streamURL = '/stream/channel/' + str(uuid)
+        thumb = None
+        fallbackThumb = None
+        epgThumb = None
+        art = R(ART)
+
+        # Expire the page when the current show on this channel changes
+        if tvhEPGStore:
+            epgChange = epgNextChange(tvhEPGStore, uuid)
+            if epgChange:
+                pageExpires = min(pageExpires, epgChange)
+
+        summary = None
+        tagline = None
+        source_title = None
+        year = None
+        rating = None
+        content_rating = None
+        genres = ' '
+        artist = None
+
+        # Set channel attributes using Tvheadend channel tags
+        streamVideo, streamAudio, streamType, streamResolution = snapshot['channelIndex'][uuid][1]
+
+        # Set audio channel title metadata per client
+        if streamType == 'radio':
+            if Client.Product == 'Plex Web':
+                artist = title
+                title = ' '
+            else:
+                title = title
+                artist = ' '
+
+        # Set channel metadata using Tvheadend EPG info
+        if tvhEPGStore:
+            tvhEPGEntry = epgNowPlaying(tvhEPGStore, uuid)
+            if tvhEPGEntry:
+                epgStart = int(tvhEPGEntry.get('start'))
+                epgStop = int(tvhEPGEntry.get('stop'))
+                epgSubtitle = tvhEPGEntry.get('subtitle')
+                epgSummary = tvhEPGEntry.get('summary')
+                epgDescription = tvhEPGEntry.get('description')
+
+                epgDupedSubtitleSummary = False
+                if epgSubtitle and epgSummary and epgSubtitle == epgSummary:
+                    epgDupedSubtitleSummary = True # Some EPG providers duplicate info in these fields
+
+                # Set the show title
+                title = title + ': ' + tvhEPGEntry['title']
+
+                # Set times
+                if Prefs['pref24Time']:
+                    startTime = time.strftime('%H:%M', time.localtime(epgStart))
+                    stopTime = time.strftime('%H:%M', time.localtime(epgStop))
+                else:
+                    startTime = time.strftime('%I:%M%p', time.localtime(epgStart)).lstrip('0').lower()
+                    stopTime = time.strftime('%I:%M%p', time.localtime(epgStop)).lstrip('0').lower()
+
+                # Set the titles and summary per client
+                if Client.Product == 'Plex Web':
+                    title = title + '                                        ' # Force Plex Web to use the Details view by padding the title
+                    tagline = startTime + '-' + stopTime
+
+                    if epgDupedSubtitleSummary:
+                        if epgDescription:
+                            tagline = tagline + ': ' + epgSubtitle
+                            summary = epgDescription + '\n'
+                        else:
+                            summary = epgSummary + '\n'
+                    else:
+                        if epgSubtitle: tagline = tagline + ': ' + epgSubtitle
+                        if epgSummary: summary = epgSummary + '\n'
+                        if epgDescription: summary = epgDescription + '\n'
+
+                elif Client.Product == 'Plex for Roku':
+                    source_title = startTime + '-' + stopTime
+
+                    if epgDupedSubtitleSummary:
+                        if epgDescription:
+                            source_title = source_title + ': ' + epgSubtitle
+                            summary = epgDescription + '\n'
+                        else:
+                            summary = epgSummary + '\n'
+                    else:
+                        if epgSubtitle: source_title = source_title + ': ' + epgSubtitle
+                        if epgSummary: summary = epgSummary + '\n'
+                        if epgDescription: summary = epgDescription + '\n'
+
+                elif Client.Product == 'Plex for Android':
+                    source_title = startTime + '-' + stopTime
+                    summary = startTime + '-' + stopTime
+
+                    if epgDupedSubtitleSummary:
+                        if epgDescription:
+                            title = title + ' (' + epgSubtitle + ')'
+                            summary = summary + ': ' + epgDescription + '\n'
+                        else:
+                            summary = summary + ': ' + epgSummary + '\n'
+                    else:
+                        if epgSubtitle: title = title + ' (' + epgSubtitle + ')'
+                        if epgSummary or epgDescription:
+                            if epgSummary: summary = summary + ': ' + epgSummary + '\n'
+                            if epgDescription: summary = summary + ': ' + epgDescription + '\n'
+                        else:
+                            summary = summary + '\n'
+
+                else:
+                    summary = startTime + '-' + stopTime
+
+                    if epgDupedSubtitleSummary:
+                        if epgDescription:
+                            title = title + ' (' + epgSubtitle + ')'
+                            summary = summary + ': ' + epgDescription + '\n'
+                        else:
+                            summary = summary + ': ' + epgSummary + '\n'
+                    else:
+                        if epgSubtitle: title = title + ' (' + epgSubtitle + ')'
+                        if epgSummary or epgDescription:
+                            if epgSummary: summary = summary + ': ' + epgSummary + '\n'
+                            if epgDescription: summary = summary + ': ' + epgDescription + '\n'
+                        else:
+                            summary = summary + '\n'
+
+                # List upcoming titles on this channel in the summary by searching for shows
+                # in the next number of hours or number of entries, whichever is greater
+                epgCount = int(Prefs['prefEPGCount'])
+                timeLimit = int(time.time()) + (epgCount*3600)
+
+                for nextEntry in epgUpcoming(tvhEPGStore, tvhEPGEntry, epgCount, timeLimit):
+                    if Prefs['pref24Time']:
+                        nextStartTime = time.strftime('%H:%M', time.localtime(int(nextEntry['start'])))
+                    else:
+                        nextStartTime = time.strftime('%I:%M%p', time.localtime(int(nextEntry['start']))).lstrip('0').lower()
+
+                    if summary:
+                        summary = summary + nextStartTime + ': ' + nextEntry['title'] + '\n'
+                    else:
+                        summary = nextStartTime + ': ' + nextEntry['title'] + '\n'
+
+                # Set metadata for this title if it was found in time for this page
+                metadataResults = metadataPage.get((tvhEPGEntry['title'], epgZap2itID(tvhEPGEntry)))
+                if Prefs['prefMetadata'] and metadataResults is None:
+                    pageComplete = False
+
+                if metadataResults:
+                    if metadataResults['thumb']: thumb = metadataResults['thumb']
+                    if metadataResults['art']: art = metadataResults['art']
+                    if metadataResults['year']: year = int(metadataResults['year'])
+                    if metadataResults['rating']: rating = float(metadataResults['rating'])
+                    if metadataResults['content_rating']: content_rating = metadataResults['content_rating']
+                    if metadataResults['genres']: genres = metadataResults['genres']
+                    if metadataResults['zap2itMissingID'] and improveTheTVDB:
+                        summary = metadataResults['zap2itMissingID'] + ' | ' + summary
+
+                # Check the EPG entry for a thumbnail
+                if tvhEPGEntry.get('image') and tvhEPGEntry['image'].startswith('http'):
+                    epgThumb = tvhEPGEntry['image']
+
+        # Use EPG thumbnails from Tvheadend if a thumbnail is not available from the metadata providers
+        if thumb is None and epgThumb:
+            thumb = epgThumb
+
+        if fallbackThumb is None and epgThumb:
+            fallbackThumb = epgThumb
+
+        # Use channel icons from Tvheadend if no other thumbnail is available
+        try:
+            if thumb is None:
+                if tvhChannel['icon_public_url'].startswith('imagecache'):
+                    thumb = '{}/{}'.format(tvhAddress, tvhChannel['icon_public_url'])
+                elif tvhChannel['icon_public_url'].startswith('http'):
+                    thumb = tvhChannel['icon_public_url']
+
+            if tvhChannel['icon_public_url'].startswith('imagecache'):
+                fallbackThumb ='{}/{}'.format(tvhAddress, tvhChannel['icon_public_url'])
+            elif tvhChannel['icon_public_url'].startswith('http'):
+                fallbackThumb = tvhChannel['icon_public_url']
+
+        except: pass
+
+        # Set the channel object type - this determines if thumbnails are displayed as posters or video clips
+        # Plex for Roku only displays source_title for VideoClipObjects
+        if streamType == 'radio':
+            channelType = 'TrackObject'
+        else:
+            if Client.Product == 'Plex Home Theater':
+                channelType = 'MovieObject'
+            elif Client.Product == 'Plex for Roku' or not Prefs['prefMetadata']:
+                channelType = 'VideoClipObject'
+            else:
+                channelType = 'MovieObject'
+
+        # Add the arguments to build the channel with
+        pageItems.append(
+            dict(
+                channelType=channelType,
+                title=title,
+                streamURL=streamURL,
+                streamVideo=streamVideo,
+                streamAudio=streamAudio,
+                streamResolution=streamResolution,
+                thumb=thumb,
+                fallbackThumb=fallbackThumb,
+                art=art,
+                summary=summary,
+                tagline=tagline,
+                source_title=source_title,
+                year=year,
+                rating=rating,
+                content_rating=content_rating,
+                genres=genres,
+                artist=artist))
+
+    if pageComplete:
+        return pageExpires, pageItems
+
+    return None, pageItems
+
+
+# Parse a Tvheadend channel number into a sort key - sub-channels such as 5.1 follow their major channel,
+# and channels without a number are sorted last
+def channelNumber(tvhChannel):
+    try:
+        numberParts = str(tvhChannel['number']).split('.', 1)
+        if len(numberParts) == 2:
+            return (0, int(numberParts[0]), int(numberParts[1]))
+
+        return (0, int(numberParts[0]), 0)
+
+    except (KeyError, TypeError, ValueError):
+        return (1, 0, 0)
+
+
+# Build the guide time slots from now until the end of the EPG
+@route(PREFIX + '/guide')
+def guide():
+    snapshot = currentSnapshot()
+    guideContainer = ObjectContainer(title1=L('guide'), no_cache=True)
+
+    # Displays an error message to clients if Tvheadend is malfunctional
+    if snapshot is None:
+        guideContainer.add(DirectoryObject(title=L('channelsUnavailable')))
+        return guideContainer
+
+    guideContainer.add(DirectoryObject(key=Callback(guideSlot), title=L('guideNow')))
+
+    now = int(time.time())
+    for slotTime in sorted(snapshot['epg']['slots']):
+        if slotTime > now:
+            guideContainer.add(DirectoryObject(key=Callback(guideSlot, slotTime=slotTime), title=guideTime(slotTime, True)))
+
+    guideContainer.add(
+        InputDirectoryObject(
+            key=Callback(searchGuide),
+            title=L('searchGuide'),
+            prompt=L('searchGuidePrompt')))
+
+    return guideContainer
+
+
+# Search the guide for upcoming shows by title, subtitle and description
+@route(PREFIX + '/guide/search', startCount=int)
+def searchGuide(query='', startCount=0):
+    snapshot = currentSnapshot()
+    nextStartCount = startCount + int(Prefs['prefPageCount'])
+    guideContainer = ObjectContainer(title1=L('searchGuide'), title2=query, no_cache=True)
+
+    # Displays an error message to clients if Tvheadend is malfunctional
+    if snapshot is None:
+        guideContainer.add(DirectoryObject(title=L('channelsUnavailable')))
+        return guideContainer
+
+    tvhEPGStore = snapshot['epg']
+    tvhChannelIndex = snapshot['channelIndex']
+    now = int(time.time())
+
+    # Check the matching shows in start time order until the page is filled
+    searchEntries = []
+    for eventId in sorted(searchTokenIndex(tvhEPGStore['tokenList'], tvhEPGStore['tokens'], query), key=tvhEPGStore['order'].get):
+        tvhEPGEntry = tvhEPGStore['events'][eventId]
+        if int(tvhEPGEntry['stop']) > now and tvhEPGEntry.get('title') and tvhEPGEntry['channelUuid'] in tvhChannelIndex:
+            searchEntries.append(tvhEPGEntry)
+            if len(searchEntries) > nextStartCount:
+                break
+
+    # Each show links to the other shows playing at the same time
+    for tvhEPGEntry in searchEntries[startCount:nextStartCount]:
+        epgStart = int(tvhEPGEntry['start'])
+        guideContainer.add(
+            DirectoryObject(
+                key=Callback(guideSlot, slotTime=max(epgStart, now)),
+                title=guideTime(epgStart, True) + ' ' + (tvhChannelIndex[tvhEPGEntry['channelUuid']][0].get('name') or '') + ': ' + tvhEPGEntry['title'],
+                tagline=guideTime(epgStart) + '-' + guideTime(int(tvhEPGEntry['stop'])),
+                summary=guideSummary(tvhEPGEntry)))
+
+    # Paginate the search results
+    if len(searchEntries) > nextStartCount:
+        guideContainer.add(NextPageObject(key=Callback(searchGuide, query=query, startCount=nextStartCount), title=L('next'), thumb=R('next.png')))
+
+    return guideContainer
+
+
+# Build the list of shows playing on each channel at a time, or now if no time is set
+@route(PREFIX + '/guide/slot', slotTime=int, startCount=int)
+def guideSlot(slotTime=None, startCount=0):
+    snapshot = currentSnapshot()
+    nextStartCount = startCount + int(Prefs['prefPageCount'])
+    if not slotTime:
+        slotTime = int(time.time())
+
+    guideContainer = ObjectContainer(title1=L('guide'), title2=guideTime(slotTime, True), no_cache=True)
+
+    # Displays an error message to clients if Tvheadend is malfunctional
+    if snapshot is None:
+        guideContainer.add(DirectoryObject(title=L('channelsUnavailable')))
+        return guideContainer
+
+    # Find the show playing on each channel from the time slot, listing channels in channel number order
+    tvhChannelIndex = snapshot['channelIndex']
+    slotEntries = {}
+    for tvhEPGEntry in snapshot['epg']['slots'].get(slotTime - slotTime % guideSlotTime, ()):
+        uuid = tvhEPGEntry['channelUuid']
+        if uuid in tvhChannelIndex and int(tvhEPGEntry['start']) <= slotTime < int(tvhEPGEntry['stop']) and tvhEPGEntry.get('title'):
+            if uuid not in slotEntries or int(tvhEPGEntry['start']) > int(slotEntries[uuid]['start']):
+                slotEntries[uuid] = tvhEPGEntry
+
+    slotChannels = sorted(slotEntries, key=lambda u: (channelNumber(tvhChannelIndex[u][0]), tvhChannelIndex[u][0].get('name') or ''))
+
+    for uuid in slotChannels[startCount:nextStartCount]:
+        tvhChannel = tvhChannelIndex[uuid][0]
+        tvhEPGEntry = slotEntries[uuid]
+
+        title = tvhChannel.get('name') or ''
+        if Prefs['prefChannelNumbers'] and tvhChannel.get('number') is not None:
+            title = str(tvhChannel['number']) + ' ' + title
+
+        guideContainer.add(
+            DirectoryObject(
+                key=Callback(guideChannel, uuid=uuid),
+                title=title + ': ' + tvhEPGEntry['title'],
+                tagline=guideTime(int(tvhEPGEntry['start'])) + '-' + guideTime(int(tvhEPGEntry['stop'])),
+                summary=guideSummary(tvhEPGEntry)))
+
+    # Paginate the guide
+    if len(slotChannels) > nextStartCount:
+        guideContainer.add(NextPageObject(key=Callback(guideSlot, slotTime=slotTime, startCount=nextStartCount), title=L('next'), thumb=R('next.png')))
+
+    return guideContainer
+
+
+# Build the list of shows on a channel over the next day
+@route(PREFIX + '/guide/channel', startCount=int)
+def guideChannel(uuid, startCount=0):
+    snapshot = currentSnapshot()
+    nextStartCount = startCount + int(Prefs['prefPageCount'])
+
+    # Displays an error message to clients if Tvheadend is malfunctional
+    if snapshot is None:
+        errorContainer = ObjectContainer(title1=L('guide'), no_cache=True)
+        errorContainer.add(DirectoryObject(title=L('channelsUnavailable')))
+        return errorContainer
+
+    channelName = None
+    if uuid in snapshot['channelIndex']:
+        channelName = snapshot['channelIndex'][uuid][0].get('name')
+
+    guideContainer = ObjectContainer(title1=L('guide'), title2=channelName, no_cache=True)
+
+    # Find shows on the channel from the one playing now until the same time tomorrow
+    now = int(time.time())
+    channelEntries = []
+    epgChannel = snapshot['epg']['channels'].get(uuid)
+    if epgChannel:
+        epgIndex = max(bisect.bisect_right(epgChannel['starts'], now) - 2, 0)
+        epgEnd = bisect.bisect_left(epgChannel['starts'], now + 86400)
+        for tvhEPGEntry in epgChannel['entries'][epgIndex:epgEnd]:
+            if int(tvhEPGEntry['stop']) > now and tvhEPGEntry.get('title'):
+                channelEntries.append(tvhEPGEntry)
+
+    # Each show links to the other shows playing at the same time
+    for tvhEPGEntry in channelEntries[startCount:nextStartCount]:
+        epgStart = int(tvhEPGEntry['start'])
+        guideContainer.add(
+            DirectoryObject(
+                key=Callback(guideSlot, slotTime=max(epgStart, now)),
+                title=guideTime(epgStart, True) + ': ' + tvhEPGEntry['title'],
+                tagline=guideTime(epgStart) + '-' + guideTime(int(tvhEPGEntry['stop'])),
+                summary=guideSummary(tvhEPGEntry)))
+
+    # Paginate the guide
+    if len(channelEntries) > nextStartCount:
+        guideContainer.add(NextPageObject(key=Callback(guideChannel, uuid=uuid, startCount=nextStartCount), title=L('next'), thumb=R('next.png')))
+
+    return guideContainer
+
+
+# Format a guide time using the time preference, with the day of the week for days other than today
+def guideTime(timestamp, showDay=False):
+    if Prefs['pref24Time']:
+        guideTimeText = time.strftime('%H:%M', time.localtime(timestamp))
+    else:
+        guideTimeText = time.strftime('%I:%M%p', time.localtime(timestamp)).lstrip('0').lower()
+
+    if showDay and time.strftime('%Y%m%d', time.localtime()) != time.strftime('%Y%m%d', time.localtime(timestamp)):
+        guideTimeText = time.strftime('%A ', time.localtime(timestamp)) + guideTimeText
+
+    return guideTimeText
+
+
+# Combine the subtitle and description of a show for the guide
+def guideSummary(tvhEPGEntry):
+    guideText = []
+    if tvhEPGEntry.get('subtitle'):
+        guideText.append(tvhEPGEntry['subtitle'])
+
+    if tvhEPGEntry.get('description'):
+        guideText.append(tvhEPGEntry['description'])
+    elif tvhEPGEntry.get('summary') and tvhEPGEntry.get('summary') != tvhEPGEntry.get('subtitle'):
+        guideText.append(tvhEPGEntry['summary'])
+
+    return '\n'.join(guideText) or None
+
+
+# Build an EPG store from Tvheadend EPG entries
+# Each channel has its entries sorted by start time for binary searches, events are indexed by eventId,
+# guide time slots list the shows playing during each slot, and events are indexed by the words they contain
+# and by their order of start times
+def epgStore(tvhEPGEntries):
+    epgChannels = {}
+    epgEvents = {}
+
+    epgSlots = {}
+    epgTokens = {}
+
+    for tvhEPGEntry in tvhEPGEntries:
+        try:
+            epgStart = int(tvhEPGEntry['start'])
+            epgStop = int(tvhEPGEntry['stop'])
+            epgChannels.setdefault(tvhEPGEntry['channelUuid'], []).append((epgStart, tvhEPGEntry))
+            epgEvents[tvhEPGEntry['eventId']] = tvhEPGEntry
+
+            # Add the show to each guide time slot it plays in
+            for slotStart in range(epgStart - epgStart % guideSlotTime, epgStop, guideSlotTime):
+                epgSlots.setdefault(slotStart, []).append(tvhEPGEntry)
+
+            # Index the words of the show for guide searches
+            for token in searchTokens((tvhEPGEntry.get('title'), tvhEPGEntry.get('subtitle'), tvhEPGEntry.get('description'))):
+                epgTokens.setdefault(token, set()).add(tvhEPGEntry['eventId'])
+
+        except (KeyError, TypeError, ValueError): pass
+
+    for uuid, epgChannelEntries in epgChannels.items():
+        epgChannelEntries.sort(key=lambda e: e[0])
+        epgChannels[uuid] = {
+            'starts': [e[0] for e in epgChannelEntries],
+            'entries': [e[1] for e in epgChannelEntries]}
+
+    epgOrder = {}
+    for epgIndex, eventId in enumerate(sorted(epgEvents, key=lambda e: int(epgEvents[e]['start']))):
+        epgOrder[eventId] = epgIndex
+
+    return {
+        'channels': epgChannels,
+        'events': epgEvents,
+        'slots': epgSlots,
+        'tokens': epgTokens,
+        'tokenList': sorted(epgTokens),
+        'order': epgOrder}
+
+
+# Find the show currently playing on a channel in the EPG store
+def epgNowPlaying(tvhEPGStore, uuid, now=None):
+    epgChannel = tvhEPGStore['channels'].get(uuid)
+    if epgChannel is None:
+        return None
+
+    if now is None:
+        now = time.time()
+
+    # Check the last show starting before now, and the one before it in case of overlapping EPG entries
+    epgIndex = bisect.bisect_right(epgChannel['starts'], now) - 1
+    for tvhEPGEntry in epgChannel['entries'][max(epgIndex - 1, 0):epgIndex + 1][::-1]:
+        if now < int(tvhEPGEntry['stop']) and tvhEPGEntry.get('title'):
+            return tvhEPGEntry
+
+    return None
+
+
+# Find the next time the show playing on a channel changes in the EPG store
+def epgNextChange(tvhEPGStore, uuid, now=None):
+    epgChannel = tvhEPGStore['channels'].get(uuid)
+    if epgChannel is None:
+        return None
+
+    if now is None:
+        now = time.time()
+
+    tvhEPGEntry = epgNowPlaying(tvhEPGStore, uuid, now)
+    if tvhEPGEntry:
+        return int(tvhEPGEntry['stop'])
+
+    epgIndex = bisect.bisect_right(epgChannel['starts'], now)
+    if epgIndex < len(epgChannel['starts']):
+        return epgChannel['starts'][epgIndex]
+
+    return None
+
+
+# Check if an EPG entry has a zap2it ID
+def epgZap2itID(tvhEPGEntry):
+    zap2itID = None
+    try:
+        if tvhEPGEntry.get('episodeUri'):
+            epgID=tvhEPGEntry['episodeUri'].split('/')[3].split('.')[0]
+            if epgID.startswith('MV') or epgID.startswith('EP') or epgID.startswith('SH'):
+                zap2itID = epgID
+    except: pass
+
+    return zap2itID
+
+
+# Follow the nextEventId chain from an EPG entry to find upcoming shows
+# Shows are listed for the next number of hours or number of entries, whichever is greater
+def epgUpcoming(tvhEPGStore, tvhEPGEntry, epgCount, timeLimit):
+    epgUpcomingEntries = []
+    epgVisitedEvents = set([tvhEPGEntry.get('eventId')])
+    nextEventID = tvhEPGEntry.get('nextEventId')
+
+    for epgHop in range(epgUpcomingLimit):
+        if not nextEventID:
+            break
+
+        # Some EPG providers link events in a loop
+        if nextEventID in epgVisitedEvents:
+            Log.Warn('Tvheadend EPG event ' + str(nextEventID) + ' links back to a previous event, ending the upcoming shows list.')
+            break
+
+        nextEntry = tvhEPGStore['events'].get(nextEventID)
+        if nextEntry is None:
+            break
+
+        if int(nextEntry['start']) > timeLimit and len(epgUpcomingEntries) >= epgCount:
+            break
+
+        if nextEntry.get('title'):
+            epgUpcomingEntries.append(nextEntry)
+
+        epgVisitedEvents.add(nextEventID)
+        nextEventID = nextEntry.get('nextEventId')
+
+    return epgUpcomingEntries
 
 
 # Build the channel
@@ -632,7 +1799,7 @@ def channel(
         rating_key = rating_key,
         title = title,
         thumb = Callback(image, url=thumb, fallback=fallbackThumb),
-        art = Callback(image, url=art, fallback=R(ART)),
+        art = Callback(image, url=art, fallback=R(ART), width=imageArtWidth),
         summary = summary,
         source_title = source_title,
         tagline = tagline,
@@ -648,20 +1815,19 @@ def channel(
             content_rating=content_rating, genres=genres, artist=artist, container=True, checkFiles=0, **kwargs),
         rating_key = streamURL,
         thumb = Callback(image, url=thumb, fallback=fallbackThumb),
-        art = Callback(image, url=art, fallback=R(ART)),
+        art = Callback(image, url=art, fallback=R(ART), width=imageArtWidth),
         title = title,
         artist = artist,
         rating = rating,
         genres = [genres])
 
-    if Prefs['prefDirectStream'] and streamVideo and streamAudio:
-        # Add basic authentication info to the stream URL - Plex ignores the headers parameter in PartObject
-        tvhBasicAuth = '//{}:{}@'.format(Prefs['tvhUser'], Prefs['tvhPass'])
-        tvhAuthAddress = tvhAddress.replace('//', tvhBasicAuth)
-        playbackURL = '{}{}'.format(tvhAuthAddress, streamURL)
+    # Play channels that were recently verified directly instead of through the stream route
+    streamKey = Callback(stream, streamURL=streamURL)
+    if Prefs['prefFastZap'] and streamVerified(streamURL):
+        streamKey = streamPlaybackURL(streamURL)
 
-        if Prefs['tvhProfile']:
-            playbackURL = playbackURL + '?profile=' + Prefs['tvhProfile']
+    if Prefs['prefDirectStream'] and streamVideo and streamAudio:
+        playbackURL = streamPlaybackURL(streamURL)
 
         if streamResolution == '720p':
             videoChannelMediaData = dict(
@@ -723,7 +1889,7 @@ def channel(
                 items = [
                     MediaObject(
                         parts = [PartObject(
-                            key=Callback(stream, streamURL=streamURL))],
+                            key=streamKey)],
                         video_resolution = '1080',
                         container = 'mpegts',
                         duration = 86400000,
@@ -734,7 +1900,7 @@ def channel(
                 items = [
                     MediaObject(
                         parts = [PartObject(
-                            key=Callback(stream, streamURL=streamURL))],
+                            key=streamKey)],
                         video_resolution = '720',
                         container = 'mpegts',
                         duration = 86400000,
@@ -745,7 +1911,7 @@ def channel(
                 items = [
                     MediaObject(
                         parts = [PartObject(
-                            key=Callback(stream, streamURL=streamURL))],
+                            key=streamKey)],
                         video_resolution = '576',
                         container = 'mpegts',
                         duration = 86400000,
@@ -756,7 +1922,7 @@ def channel(
             items = [
                 MediaObject(
                     parts = [PartObject(
-                        key=Callback(stream, streamURL=streamURL))],
+                        key=streamKey)],
                     video_resolution = '1080',
                     container = 'mpegts',
                     duration = 86400000,
@@ -767,7 +1933,7 @@ def channel(
             audioChannelMediaData = dict(
                 items = [
                     MediaObject(
-                        parts = [PartObject(key=Callback(stream, streamURL=streamURL))],
+                        parts = [PartObject(key=streamKey)],
                         audio_codec = streamAudio,
                         audio_channels = 2,
                         optimized_for_streaming = True)])
@@ -776,7 +1942,7 @@ def channel(
             audioChannelMediaData = dict(
                 items = [
                     MediaObject(
-                        parts = [PartObject(key=Callback(stream, streamURL=streamURL))],
+                        parts = [PartObject(key=streamKey)],
                         audio_channels = 2,
                         optimized_for_streaming = True)])
 
@@ -786,95 +1952,435 @@ def channel(
         channelData.update(audioChannelMediaData)
         channelObject = TrackObject(**channelData)
 
-    else:
-        channelData = videoChannelMetadata.copy()
-        channelData.update(videoChannelMediaData)
+    else:
+        channelData = videoChannelMetadata.copy()
+        channelData.update(videoChannelMediaData)
+
+        # Set the framework object type
+        if channelType == 'MovieObject':
+            channelObject = MovieObject(**channelData)
+
+        elif channelType == 'VideoClipObject':
+            channelObject = VideoClipObject(**channelData)
+
+    if container:
+        return ObjectContainer(objects=[channelObject])
+    else:
+        return channelObject
+
+
+# Build the Tvheadend stream URL and verify availability
+@route(PREFIX + '/stream')
+@indirect
+def stream(streamURL):
+
+    # Verify the channel is available before returning it to PartObject
+    with statsSpan('stream.check'):
+        available = streamAvailable(streamURL)
+
+    if available:
+        return IndirectResponse(MovieObject, key=streamPlaybackURL(streamURL))
+
+    raise Ex.MediaNotAvailable
+
+
+# Gets the playback URL for a stream, using the URL built for the current snapshot if available
+def streamPlaybackURL(streamURL):
+    snapshot = tvhSnapshot
+    if snapshot and streamURL in snapshot['playbackURLs']:
+        return snapshot['playbackURLs'][streamURL]
+
+    return buildPlaybackURL(streamURL)
+
+
+# Builds the playback URL for a stream
+def buildPlaybackURL(streamURL):
+
+    # Add basic authentication info to the stream URL - Plex ignores the headers parameter in PartObject
+    tvhBasicAuth = '//{}:{}@'.format(Prefs['tvhUser'], Prefs['tvhPass'])
+    tvhAuthAddress = tvhAddress.replace('//', tvhBasicAuth)
+    playbackURL = '{}{}'.format(tvhAuthAddress, streamURL)
+
+    if Prefs['tvhProfile']:
+        playbackURL = playbackURL + '?profile=' + Prefs['tvhProfile']
+
+    return playbackURL
+
+
+# Checks if a stream was verified as available within the last fastZapTime seconds
+def streamVerified(streamURL):
+    return time.time() - streamVerifiedTimes.get(streamURL, 0) < fastZapTime
+
+
+# Checks if a stream is available, caching the result for streamProbeCacheTime seconds
+# Channels are checked using the Tvheadend status when possible, since requesting the stream subscribes to the
+# channel and ties up a tuner - the stream itself is only requested if the status does not show the channel can be streamed
+def streamAvailable(streamURL):
+    streamProbeEntry = streamProbeCache.get(streamURL)
+    if streamProbeEntry and time.time() < streamProbeEntry[0]:
+        return streamProbeEntry[1]
+
+    available = None
+    if streamURL.startswith('/stream/channel/'):
+        available = streamProbe(streamURL[len('/stream/channel/'):])
+
+    if available is None:
+        try:
+            tvhRelease(tvhOpen('{}{}'.format(tvhAddress, streamURL)))
+            available = True
+
+        except Exception as e:
+            Log.Warn('Tvheadend is not responding to this channel request - verify that there are available tuners: ' + repr(e))
+            available = False
+
+    streamProbeCache[streamURL] = (time.time() + streamProbeCacheTime, available)
+    if available:
+        streamVerifiedTimes[streamURL] = time.time()
+    else:
+        streamVerifiedTimes.pop(streamURL, None)
+
+    return available
+
+
+# Checks the Tvheadend status for a tuner that can stream a channel without subscribing to it
+# Returns True if no tuners are in use or the channel is already streaming, otherwise None, as the status does not
+# show if an idle or unused tuner can receive the channel's network and mux - the status is not checked again if
+# the Tvheadend user does not have access to it
+def streamProbe(uuid):
+    global tvhStatusAccess
+
+    if tvhStatusAccess is False:
+        return None
+
+    try:
+        tvhInputs = JSON.ObjectFromString(tvhRead(tvhAddress + '/api/status/inputs'))['entries']
+        tvhStatusAccess = True
+        if not any(int(tvhInput.get('subs', 0)) for tvhInput in tvhInputs):
+            return True
+
+        # Tvheadend shares the tuner with an existing subscription to the channel
+        channelName = None
+        snapshot = tvhSnapshot
+        if snapshot and uuid in snapshot['channelIndex']:
+            channelName = snapshot['channelIndex'][uuid][0].get('name')
+
+        if channelName:
+            tvhSubscriptions = JSON.ObjectFromString(tvhRead(tvhAddress + '/api/status/subscriptions'))['entries']
+            for tvhSubscription in tvhSubscriptions:
+                if tvhSubscription.get('channel') == channelName:
+                    return True
+
+    except Exception as e:
+        if isinstance(e, urllib2.HTTPError) and e.code == 403:
+            Log.Info('The Tvheadend user does not have access to the tuner status, channels will be checked by requesting the stream')
+            tvhStatusAccess = False
+        else:
+            Log.Info('Unable to check the Tvheadend tuner status: ' + str(e))
+
+    return None
+
+
+# Requests the number of finished recordings from Tvheadend with a single recording instead of the whole list
+tvhGridTotal = re.compile(r'"total"\s*:\s*(\d+)')
+
+def recordingsCount():
+    tvhRecordingsURL = str(tvhAddress) + '/api/dvr/entry/grid_finished?start=0&limit=1'
+    totalMatch = tvhGridTotal.search(tvhRead(tvhRecordingsURL))
+    if totalMatch is None:
+        raise ValueError('Missing recordings total')
+
+    return int(totalMatch.group(1))
+
+
+# Synchronizes the recordings search index with recordings finished since the last update
+# All recordings are only listed again when the number of recordings does not match, such as after recordings are removed
+def syncRecordings(tvhRecordingsCount):
+    global recordingsSyncedUntil
+
+    recordingsFilter = [{'field': 'stop', 'type': 'numeric', 'value': recordingsSyncedUntil - 1, 'comparison': 'gt'}]
+    tvhRecordingsURL = '{}/api/dvr/entry/grid_finished?start=0&limit={}&sort=stop&dir=ASC&filter={}'.format(
+        tvhAddress, tvhRecordingsCount + 1, String.Quote(JSON.StringFromObject(recordingsFilter)))
+
+    try:
+        for tvhRecording in tvhGrid(tvhRecordingsURL, 'recordings'):
+            recordingsIndexAdd(tvhRecording)
+            recordingsSyncedUntil = max(recordingsSyncedUntil, int(tvhRecording['stop']))
+
+        if len(recordingsIndex) != tvhRecordingsCount:
+            recordingsSeen = set()
+            recordingsStart = 0
+
+            while True:
+                tvhRecordingsURL = '{}/api/dvr/entry/grid_finished?start={}&limit={}&sort=stop&dir=ASC'.format(
+                    tvhAddress, recordingsStart, recordingsPageSize)
+
+                recordingsPageCount = 0
+                for tvhRecording in tvhGrid(tvhRecordingsURL, 'recordings'):
+                    recordingsPageCount += 1
+                    recordingsSeen.add(tvhRecording['uuid'])
+                    if tvhRecording['uuid'] not in recordingsIndex:
+                        recordingsIndexAdd(tvhRecording)
+
+                if recordingsPageCount < recordingsPageSize:
+                    break
+
+                recordingsStart = recordingsStart + recordingsPageSize
+
+            for uuid in [uuid for uuid in recordingsIndex if uuid not in recordingsSeen]:
+                recordingsIndexRemove(uuid)
+
+    except Exception as e:
+        Log.Warn('Error updating the Tvheadend recordings search index: ' + str(e))
+
+    if debug: Log.Debug('Recordings indexed: ' + str(len(recordingsIndex)))
+
+
+# Splits text into lowercase search tokens
+searchTokenPattern = re.compile(r'\w+', re.UNICODE)
+
+def searchTokens(searchText):
+    tokens = set()
+    for text in searchText:
+        if text:
+            tokens.update(searchTokenPattern.findall(text.lower()))
+
+    return tokens
+
+
+# Finds the items in a token index with tokens starting with each word of the query
+# The token list is the sorted tokens of the index, and token items maps each token to a set of items
+def searchTokenIndex(tokenList, tokenItems, query):
+    searchResults = None
+    for queryToken in searchTokens([query]):
+        tokenResults = set()
+        tokenIndex = bisect.bisect_left(tokenList, queryToken)
+        while tokenIndex < len(tokenList) and tokenList[tokenIndex].startswith(queryToken):
+            tokenResults.update(tokenItems[tokenList[tokenIndex]])
+            tokenIndex += 1
+
+        if searchResults is None:
+            searchResults = tokenResults
+        else:
+            searchResults = searchResults & tokenResults
+
+        if not searchResults:
+            break
+
+    return searchResults or set()
+
+
+# Splits recording text into search tokens
+def recordingTokens(tvhRecording):
+    recordingText = [
+        tvhRecording.get('disp_title'),
+        tvhRecording.get('disp_subtitle'),
+        tvhRecording.get('disp_description'),
+        tvhRecording.get('channelname')]
+
+    try:
+        recordingText.append(time.strftime('%Y-%m-%d %B %A', time.localtime(int(tvhRecording['start']))))
+    except (KeyError, TypeError, ValueError): pass
+
+    return searchTokens(recordingText)
+
+
+# Groups recordings of the same series by title
+def recordingSeriesKey(tvhRecording):
+    return ' '.join((tvhRecording.get('disp_title') or '').lower().split())
+
+
+# Adds a recording to the search index, replacing an existing recording with the same uuid
+def recordingsIndexAdd(tvhRecording):
+    uuid = tvhRecording['uuid']
+    recordingsIndexRemove(uuid)
 
-        # Set the framework object type
-        if channelType == 'MovieObject':
-            channelObject = MovieObject(**channelData)
+    Thread.AcquireLock('recordingsIndex')
+    try:
+        recordingsIndex[uuid] = tvhRecording
+        for token in recordingTokens(tvhRecording):
+            if token not in recordingsTokens:
+                recordingsTokens[token] = set()
+                bisect.insort(recordingsTokenList, token)
+            recordingsTokens[token].add(uuid)
 
-        elif channelType == 'VideoClipObject':
-            channelObject = VideoClipObject(**channelData)
+        recordingsSeries.setdefault(recordingSeriesKey(tvhRecording), set()).add(uuid)
 
-    if container:
-        return ObjectContainer(objects=[channelObject])
-    else:
-        return channelObject
+    finally:
+        Thread.ReleaseLock('recordingsIndex')
 
 
-# Build the Tvheadend stream URL and verify availability
-@route(PREFIX + '/stream')
-@indirect
-def stream(streamURL):
+# Removes a recording from the search index
+def recordingsIndexRemove(uuid):
+    Thread.AcquireLock('recordingsIndex')
+    try:
+        tvhRecording = recordingsIndex.pop(uuid, None)
+        if tvhRecording is None:
+            return
 
-    # Add basic authentication info to the stream URL - Plex ignores the headers parameter in PartObject
-    tvhBasicAuth = '//%s:%s@' % (Prefs['tvhUser'], Prefs['tvhPass'])
-    tvhAuthAddress = tvhAddress.replace('//', tvhBasicAuth)
-    playbackURL = '%s%s' % (tvhAuthAddress, streamURL)
+        for token in recordingTokens(tvhRecording):
+            recordingsTokens[token].discard(uuid)
+            if not recordingsTokens[token]:
+                del recordingsTokens[token]
+                del recordingsTokenList[bisect.bisect_left(recordingsTokenList, token)]
 
-    if Prefs['tvhProfile']:
-        playbackURL = playbackURL + '?profile=' + Prefs['tvhProfile']
+        seriesKey = recordingSeriesKey(tvhRecording)
+        recordingsSeries[seriesKey].discard(uuid)
+        if not recordingsSeries[seriesKey]:
+            del recordingsSeries[seriesKey]
 
-    # Verify the channel is available before returning it to PartObject
-    testURL = '{}{}'.format(tvhAddress, streamURL)
+    finally:
+        Thread.ReleaseLock('recordingsIndex')
 
+
+# Finds recordings with words starting with each word of the query, sorted by most recent first
+def recordingsSearch(query):
+    Thread.AcquireLock('recordingsIndex')
     try:
-        tvhResponse = urllib2.urlopen(testURL).getcode()
-        return IndirectResponse(MovieObject, key=playbackURL)
+        searchResults = searchTokenIndex(recordingsTokenList, recordingsTokens, query)
+        return sorted((recordingsIndex[uuid] for uuid in searchResults), key=lambda r: r['start'], reverse=True)
 
-    except Exception as e:
-        Log.Warn('Tvheadend is not responding to this channel request - verify that there are available tuners: ' + repr(e))
-        raise Ex.MediaNotAvailable
+    finally:
+        Thread.ReleaseLock('recordingsIndex')
 
 
 # Build the Tvheadend recordings list
-@route(PREFIX + '/recordings', tvhVideoTags=dict, tvhAudioTags=dict, startCount=int)
-def recordings(tvhVideoTags, tvhAudioTags, startCount=0):
+@route(PREFIX + '/recordings', startCount=int)
+def recordings(startCount=0):
     nextStartCount = startCount + int(Prefs['prefPageCount'])
     recordingsContainer = ObjectContainer(title1=L('recordings'), no_cache=True)
 
-    # Request recordings data as UTF-8 with fallback to ISO-8859-1
-    tvhRecordingsData = None
-    tvhRecordingsURL = str(tvhAddress) + '/api/dvr/entry/grid_finished'
-    recordingsUTF8Encoding = True
-
-    while True:
-        try:
-            if recordingsUTF8Encoding:
-                recordingsEncoding = 'utf-8'
-            else:
-                recordingsEncoding = 'latin-1'
-
-            rawRecordingsData = urllib2.urlopen(tvhRecordingsURL).read()
-            rawRecordingsData = re.sub(r'[\x00-\x1f]', '', rawRecordingsData) # Strip control characters from recordings data (yep, this has actually happened)
-            tvhRecordingsData = JSON.ObjectFromString(rawRecordingsData, encoding=recordingsEncoding, max_size=20971520)
-            if tvhRecordingsData: break
+    # Request a page of recordings data sorted by most recent first, with one extra recording to check for a next page
+    tvhRecordingsEntries = None
+    tvhRecordingsURL = '{}/api/dvr/entry/grid_finished?start={}&limit={}&sort=start&dir=DESC'.format(
+        tvhAddress, startCount, nextStartCount - startCount + 1)
 
-        except Exception as e:
-            if recordingsUTF8Encoding:
-                Log.Warn('Unable to retrieve Tvheadend recordings data as UTF-8, falling back to ISO-8859-1: ' + str(e))
-                recordingsUTF8Encoding = False
-            else:
-                Log.Warn('Error retrieving Tvheadend recordings data: ' + str(e))
-                break
+    try:
+        tvhRecordingsEntries = list(tvhGrid(tvhRecordingsURL, 'recordings'))
+    except: pass
 
     # Display an error message to clients if there was an error retrieving recordings data
-    if tvhRecordingsData is None:
+    snapshot = currentSnapshot()
+    if tvhRecordingsEntries is None or snapshot is None:
         errorContainer = ObjectContainer(title1=TITLE, no_cache=True)
         errorContainer.add(DirectoryObject(title=L('recordingsUnavailable')))
         return errorContainer
 
-    # Request channel data from Tvheadend
-    tvhChannelsData = None
-    tvhChannelsURL = str(tvhAddress) + '/api/channel/grid?start=0&limit=100000'
+    pageRecordings = tvhRecordingsEntries[:nextStartCount - startCount]
+    with statsSpan('render.recordings'):
+        addRecordings(recordingsContainer, pageRecordings, snapshot)
+
+    # Paginate the recordings list
+    if len(tvhRecordingsEntries) > len(pageRecordings):
+        recordingsContainer.add(NextPageObject(
+            key=Callback(
+                recordings,
+                startCount=nextStartCount),
+            title=L('next'),
+            thumb=R('next.png')))
+
+    # Add the recordings search and series to the end of the first page
+    if startCount == 0 and recordingsIndex:
+        recordingsContainer.add(
+            InputDirectoryObject(
+                key=Callback(searchRecordings),
+                title=L('searchRecordings'),
+                prompt=L('searchRecordingsPrompt')))
+
+        recordingsContainer.add(
+            DirectoryObject(
+                key=Callback(recordingSeries),
+                title=L('recordingSeries'),
+                thumb=R('recordings.png')))
+
+    return recordingsContainer
+
+
+# Search the recordings by title, subtitle, description, channel and date
+@route(PREFIX + '/recordings/search', startCount=int)
+def searchRecordings(query='', startCount=0):
+    nextPageKey = Callback(searchRecordings, query=query, startCount=startCount + int(Prefs['prefPageCount']))
+    return recordingsList(L('searchRecordings'), recordingsSearch(query), startCount, nextPageKey)
+
 
+# Build the list of recorded series
+@route(PREFIX + '/recordings/series', startCount=int)
+def recordingSeries(startCount=0):
+    nextStartCount = startCount + int(Prefs['prefPageCount'])
+    seriesContainer = ObjectContainer(title1=L('recordingSeries'), no_cache=True)
+
+    Thread.AcquireLock('recordingsIndex')
     try:
-        tvhChannelsData = JSON.ObjectFromString(urllib2.urlopen(tvhChannelsURL).read())
-    except Exception as e:
-        Log.Critical('Error retrieving Tvheadend channel data: ' + str(e))
+        seriesList = []
+        for seriesKey, seriesUUIDs in recordingsSeries.items():
+            seriesTitle = recordingsIndex[next(iter(seriesUUIDs))]['disp_title']
+            seriesList.append((seriesKey, seriesTitle, len(seriesUUIDs)))
+
+    finally:
+        Thread.ReleaseLock('recordingsIndex')
+
+    seriesList.sort()
+    for seriesKey, seriesTitle, seriesCount in seriesList[startCount:nextStartCount]:
+        seriesContainer.add(
+            DirectoryObject(
+                key=Callback(seriesRecordings, seriesKey=seriesKey),
+                title=seriesTitle + ' (' + str(seriesCount) + ')',
+                thumb=R('recordings.png')))
+
+    # Paginate the series list
+    if len(seriesList) > nextStartCount:
+        seriesContainer.add(NextPageObject(key=Callback(recordingSeries, startCount=nextStartCount), title=L('next'), thumb=R('next.png')))
+
+    return seriesContainer
+
+
+# Build the list of recordings of a series
+@route(PREFIX + '/recordings/series/recordings', startCount=int)
+def seriesRecordings(seriesKey, startCount=0):
+    Thread.AcquireLock('recordingsIndex')
+    try:
+        seriesUUIDs = recordingsSeries.get(seriesKey, ())
+        tvhRecordingsEntries = sorted((recordingsIndex[uuid] for uuid in seriesUUIDs), key=lambda r: r['start'], reverse=True)
+
+    finally:
+        Thread.ReleaseLock('recordingsIndex')
 
-    for tvhRecording in sorted(tvhRecordingsData['entries'], key=lambda r: r['start'], reverse=True)[startCount:nextStartCount]:
+    nextPageKey = Callback(seriesRecordings, seriesKey=seriesKey, startCount=startCount + int(Prefs['prefPageCount']))
+    return recordingsList(L('recordingSeries'), tvhRecordingsEntries, startCount, nextPageKey)
+
+
+# Build a page of recordings found in the recordings search index
+def recordingsList(title, tvhRecordingsEntries, startCount, nextPageKey):
+    nextStartCount = startCount + int(Prefs['prefPageCount'])
+    recordingsContainer = ObjectContainer(title1=title, no_cache=True)
+
+    # Display an error message to clients if Tvheadend is malfunctional
+    snapshot = currentSnapshot()
+    if snapshot is None:
+        recordingsContainer.add(DirectoryObject(title=L('recordingsUnavailable')))
+        return recordingsContainer
+
+    addRecordings(recordingsContainer, tvhRecordingsEntries[startCount:nextStartCount], snapshot)
+
+    # Paginate the recordings list
+    if len(tvhRecordingsEntries) > nextStartCount:
+        recordingsContainer.add(NextPageObject(key=nextPageKey, title=L('next'), thumb=R('next.png')))
+
+    return recordingsContainer
+
+
+# Add recordings to a menu
+def addRecordings(recordingsContainer, pageRecordings, snapshot):
+
+    # Use the channels from the current snapshot to set the recording codecs
+    tvhChannelIndex = snapshot['channelIndex']
+
+    # Find metadata for each recording of the page at the same time
+    metadataPage = {}
+    if Prefs['prefMetadata']:
+        with statsSpan('metadata.batch'):
+            metadataPage = metadataBatch([(tvhRecording['disp_title'], None) for tvhRecording in pageRecordings])
+
+    for tvhRecording in pageRecordings:
 
         title = tvhRecording['disp_title']
         streamURL = '/' + tvhRecording['url']
@@ -924,20 +2430,9 @@ def recordings(tvhVideoTags, tvhAudioTags, startCount=0):
             recordingTime = time.strftime('%B %d, %Y', time.localtime(tvhRecording['start']))
 
         # Set the recording codec based on the Tvheadend channel tags
-        try:
-            for tvhChannel in tvhChannelsData['entries']:
-                if tvhChannel['uuid'] == tvhRecording['channel']:
-                    for tvhChannelTagEntry in tvhChannel['tags']:
-
-                        for tvhVideoTag, tvhVideoTagUUID in tvhVideoTags.items():
-                            if tvhChannelTagEntry in tvhVideoTagUUID:
-                                streamVideo = tvhVideoTag
-
-                        for tvhAudioTag, tvhAudioTagUUID in tvhAudioTags.items():
-                            if tvhChannelTagEntry in tvhAudioTagUUID:
-                                streamAudio = tvhAudioTag
-
-        except: pass
+        tvhChannelEntry = tvhChannelIndex.get(tvhRecording.get('channel'))
+        if tvhChannelEntry:
+            streamVideo, streamAudio = tvhChannelEntry[1][:2]
 
         # Set the channel object type - this determines if thumbnails are displayed as posters or video clips
         # Plex for Roku only displays source_title for VideoClipObjects
@@ -977,9 +2472,9 @@ def recordings(tvhVideoTags, tvhAudioTags, startCount=0):
             if tvhRecording['disp_description']:
                 summary = summary + ': ' + tvhRecording['disp_description']
 
-        # Find metadata for this title
-        if Prefs['prefMetadata']:
-            metadataResults = metadata(title=tvhRecording['disp_title'])
+        # Set metadata for this title if it was found in time for this page
+        metadataResults = metadataPage.get((tvhRecording['disp_title'], None))
+        if metadataResults:
             if metadataResults['thumb']: thumb = metadataResults['thumb']
             if metadataResults['art']: art = metadataResults['art']
             if metadataResults['year']: year = int(metadataResults['year'])
@@ -1018,98 +2513,254 @@ def recordings(tvhVideoTags, tvhAudioTags, startCount=0):
                 genres=genres,
                 artist=artist))
 
-    # Paginate the channel list
-    if len(tvhRecordingsData['entries']) > nextStartCount:
-        recordingsContainer.add(NextPageObject(
-            key=Callback(
-                recordings,
-                tvhCodecTags=tvhCodecTags,
-                startCount=nextStartCount),
-            title=L('next'),
-            thumb=R('next.png')))
-
-    return recordingsContainer
-
 
 # Search for images with fallback
 # theTVDB API requires a separate HTTP request for each piece of artwork, so the
 # channel list load time can be reduced by running the search asynchronously
-@route(PREFIX + '/image')
-def image(url=None, fallback=None):
+@route(PREFIX + '/image', width=int)
+def image(url=None, fallback=None, width=None):
     if url is None and fallback is None:
         return None
 
-    if 'api.thetvdb.com' in url:
-        tvdbHeaders = {'Authorization' : 'Bearer ' + str(tvdbToken)}
-        tvdbImageData = None
+    imageContent = None
+    if url == R(ART):
+        return Redirect(R(ART))
+
+    elif url:
+        with statsSpan('image'):
+            imageContent = cachedImage(url, width)
+
+    # Use the fallback if the image is unavailable
+    if imageContent is None and fallback:
+        Log.Info('Missing artwork for ' + str(url) + ', fallback: ' + str(fallback))
+        if fallback == R(ART):
+            return Redirect(R(ART))
+
+        with statsSpan('image'):
+            imageContent = cachedImage(fallback)
+
+    if imageContent is None:
+        return None
+
+    return DataObject(imageContent, 'image/jpeg')
+
+
+# Get an image from the image cache, requesting it if it is not cached or revalidating it if it was cached more
+# than imageRevalidateTime ago. Images are stored once by content hash, and each width is cached separately.
+def cachedImage(url, width=None):
+    global imageCacheBytes
+    global imageCacheChanged
+
+    imageKey = (url, width)
+    Thread.AcquireLock('imageCache')
+    try:
+        imageEntry = imageCacheIndex.get(imageKey)
+        if imageEntry and imageEntry['hash'] not in imageCacheFiles:
+            imageEntry = None
+
+        if imageEntry:
+            imageCacheFiles[imageEntry['hash']] = imageCacheFiles.pop(imageEntry['hash'])
+
+    finally:
+        Thread.ReleaseLock('imageCache')
+
+    if imageEntry and time.time() - imageEntry['checked'] < imageRevalidateTime:
+        imageContent = loadCachedImage(imageEntry)
+        if imageContent is not None:
+            return imageContent
+        imageEntry = None
+
+    # The cached image is used if it cannot be revalidated
+    try:
+        imageURL = url
+        if 'api.thetvdb.com' in url:
+            imageURL = tvdbImageURL(url)
+            if imageURL is None:
+                return loadCachedImage(imageEntry)
+
+        imageURL = imageVariantURL(imageURL, width)
+
+        with statsSpan('image.download'):
+            if imageEntry:
+                imageContent, imageETag, imageModified = imageRequest(imageURL, imageEntry['etag'], imageEntry['modified'])
+            else:
+                imageContent, imageETag, imageModified = imageRequest(imageURL)
+
+    except Exception as e:
+        Log.Warn('Error retrieving image: ' + str(e))
+        return loadCachedImage(imageEntry)
 
+    # Keep the cached image if it has not changed
+    if imageContent is None:
+        Thread.AcquireLock('imageCache')
         try:
-            tvdbImageData = JSON.ObjectFromURL(url=url, headers=tvdbHeaders, values=None, cacheTime=imageCacheTime)
+            imageEntry['checked'] = time.time()
+            imageCacheChanged = True
+        finally:
+            Thread.ReleaseLock('imageCache')
 
-        except Ex.HTTPError as e:
-            if e.code == 404:
-                Log.Info('Missing artwork in theTVDB, fallback: ' + str(fallback))
-                if fallback == R(ART):
-                    return Redirect(R(ART))
+        return loadCachedImage(imageEntry)
 
-                elif fallback:
-                    if tvhAddress in fallback:
-                        imageContent = urllib2.urlopen(fallback).read()
-                    else:
-                        try:
-                            imageContent = HTTP.Request(url=fallback, timeout=httpTimeout, cacheTime=imageCacheTime, values=None).content
-                        except Exception as e:
-                            try:
-                                if 'https' in fallback:
-                                    imageContent = urllib2.urlopen(fallback, context=unverifiedSSL).read()
-                                    Log.Info('Falling back to unverified SSL: ' + fallback)
+    imageHash = Hash.SHA1(imageContent)
+
+    Thread.AcquireLock('imageCache')
+    try:
+        if imageHash in imageCacheFiles:
+            imageCacheFiles[imageHash] = imageCacheFiles.pop(imageHash)
+        else:
+            Data.Save('image-' + imageHash, imageContent)
+            imageCacheFiles[imageHash] = len(imageContent)
+            imageCacheBytes += len(imageContent)
+
+        imageCacheIndex[imageKey] = {
+            'hash': imageHash,
+            'etag': imageETag,
+            'modified': imageModified,
+            'checked': time.time()}
+
+        # Remove the least recently used images when the cache is over its size limit
+        while imageCacheBytes > imageCacheSize and len(imageCacheFiles) > 1:
+            evictedHash, evictedSize = imageCacheFiles.popitem(last=False)
+            imageCacheBytes -= evictedSize
+            try:
+                Data.Remove('image-' + evictedHash)
+            except Exception as e:
+                Log.Warn('Error removing cached image: ' + str(e))
 
-                            except Exception as e:
-                                Log.Warn('Error retrieving fallback image: ' + str(e))
+        imageCacheChanged = True
 
-                    return DataObject(imageContent, 'image/jpeg')
+    finally:
+        Thread.ReleaseLock('imageCache')
 
-                else: return None
+    return imageContent
 
-        if tvdbImageData:
-            for tvdbImageResult in tvdbImageData['data']:
-                url = 'http://thetvdb.com/banners/' + str(tvdbImageResult['fileName'])
-                try:
-                    imageContent = HTTP.Request(url, timeout=httpTimeout, cacheTime=imageCacheTime, values=None).content
-                    return DataObject(imageContent, 'image/jpeg')
-                except Exception as e:
-                    Log.Warn('Error retrieving image: ' + str(e))
-                    return None
 
-    elif tvhAddress in url:
+# Load a cached image, returning None if the image is not cached
+def loadCachedImage(imageEntry):
+    if imageEntry is None:
+        return None
+
+    try:
+        return Data.Load('image-' + imageEntry['hash'])
+    except Exception as e:
+        Log.Warn('Error loading cached image: ' + str(e))
+        return None
+
+
+# Request an image, revalidating with the ETag or Last-Modified date of the cached image if available
+# Returns the image and its ETag and Last-Modified date, or None for the image if the cached image has not changed
+def imageRequest(url, etag=None, modified=None):
+    imageHeaders = {}
+    if etag: imageHeaders['If-None-Match'] = etag
+    if modified: imageHeaders['If-Modified-Since'] = modified
+
+    try:
         try:
-            imageContent = urllib2.urlopen(url).read()
-            return DataObject(imageContent, 'image/jpeg')
+            if tvhAddress in url:
+                response = tvhOpen(url, imageHeaders)
+                try:
+                    return response.read(), response.getheader('ETag'), response.getheader('Last-Modified')
+                finally:
+                    tvhRelease(response)
+
+            response = HTTP.Request(url, headers=imageHeaders, timeout=httpTimeout, cacheTime=0, values=None)
+            return response.content, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+        except (Ex.HTTPError, urllib2.HTTPError):
+            raise
+
         except Exception as e:
-            Log.Warn('Error retrieving image: ' + str(e))
+            if 'https' not in url:
+                raise
+
+            response = urllib2.urlopen(urllib2.Request(url, headers=imageHeaders), context=unverifiedSSL)
+            Log.Info('Falling back to unverified SSL: ' + url)
+            return response.read(), response.info().get('ETag'), response.info().get('Last-Modified')
+
+    except urllib2.HTTPError as e:
+        if e.code == 304:
+            return None, etag, modified
+        raise
+
+
+# Find the artwork URL for a theTVDB image query
+def tvdbImageURL(url):
+    tvdbHeaders = {'Authorization' : 'Bearer ' + str(tvdbToken)}
+
+    try:
+        tvdbImageData = JSON.ObjectFromURL(url=url, headers=tvdbHeaders, values=None, cacheTime=imageCacheTime)
+
+    except Ex.HTTPError as e:
+        if e.code == 404:
             return None
+        raise
 
-    elif url == R(ART):
-        return Redirect(R(ART))
+    for tvdbImageResult in tvdbImageData['data']:
+        return 'http://thetvdb.com/banners/' + str(tvdbImageResult['fileName'])
 
-    else:
-        try:
-            imageContent = HTTP.Request(url, timeout=httpTimeout, cacheTime=imageCacheTime, values=None).content
-            return DataObject(imageContent, 'image/jpeg')
-        except Exception as e:
-            try:
-                if 'https' in url:
-                    imageContent = urllib2.urlopen(url, context=unverifiedSSL).read()
-                    Log.Info('Falling back to unverified SSL: ' + url)
-                    return DataObject(imageContent, 'image/jpeg')
-            except Exception as e:
-                Log.Warn('Error retrieving image: ' + str(e))
-                return None
+    return None
+
+
+# Use the smallest TMDb backdrop size at least as wide as requested instead of the original image
+def imageVariantURL(url, width):
+    if width and tmdbBaseURL and url.startswith(tmdbBaseURL + 'original/'):
+        for tmdbBackdropSize in tmdbBackdropSizes:
+            if tmdbBackdropSize.startswith('w') and int(tmdbBackdropSize[1:]) >= width:
+                return tmdbBaseURL + tmdbBackdropSize + url[len(tmdbBaseURL + 'original'):]
+
+    return url
+
+
+# Load the image cache index saved by a previous session
+def loadImageCache():
+    global imageCacheBytes
+
+    try:
+        if Data.Exists('imageCache'):
+            imageCacheIndexItems, imageCacheFilesItems = Data.LoadObject('imageCache')
+            imageCacheIndex.update(imageCacheIndexItems)
+            imageCacheFiles.update(imageCacheFilesItems)
+            imageCacheBytes = sum(imageCacheFiles.values())
+            Log.Info('Loaded ' + str(len(imageCacheFiles)) + ' cached images')
+
+    except Exception as e:
+        Log.Warn('Error loading the image cache: ' + str(e))
+
+
+# Save the image cache index if it has changed, removing entries for images that were evicted
+def saveImageCache():
+    global imageCacheChanged
+
+    if not imageCacheChanged:
+        return
+
+    Thread.AcquireLock('imageCache')
+    try:
+        for imageKey, imageEntry in imageCacheIndex.items():
+            if imageEntry['hash'] not in imageCacheFiles:
+                del imageCacheIndex[imageKey]
+
+        imageCacheIndexItems = imageCacheIndex.items()
+        imageCacheFilesItems = imageCacheFiles.items()
+        imageCacheChanged = False
+
+    finally:
+        Thread.ReleaseLock('imageCache')
+
+    try:
+        Data.SaveObject('imageCache', (imageCacheIndexItems, imageCacheFilesItems))
+    except Exception as e:
+        Log.Warn('Error saving the image cache: ' + str(e))
 
 
 # Search for metadata
 @route(PREFIX + '/metadata')
 def metadata(title, zap2itID=None):
+    metadataKey = (' '.join(title.lower().split()), zap2itID)
+    metadataResults = metadataCacheGet(metadataKey)
+    if metadataResults:
+        return metadataResults
+
     thumb = None
     art = None
     year = None
@@ -1117,6 +2768,7 @@ def metadata(title, zap2itID=None):
     content_rating = None
     genres = None
     zap2itMissingID = None
+    providerError = False
 
     # Skip searching theTVDB if EPG data states the title is a movie
     if str(zap2itID).startswith('MV'):
@@ -1126,8 +2778,10 @@ def metadata(title, zap2itID=None):
 
     # Search theTVDB
     if (thumb is None or art is None) and not epgMovie:
-        tvdbResults = tvdb(title, zap2itID)
+        with statsSpan('tvdb'):
+            tvdbResults = tvdb(title, zap2itID)
         if tvdbResults:
+            providerError = providerError or tvdbResults['error']
             if thumb is None: thumb = tvdbResults['poster']
             if art is None: art = tvdbResults['fanart']
             if rating is None: rating = tvdbResults['siteRating']
@@ -1137,15 +2791,17 @@ def metadata(title, zap2itID=None):
 
     # Search themovieDB
     if thumb is None or art is None:
-        tmdbResults = tmdb(title)
+        with statsSpan('tmdb'):
+            tmdbResults = tmdb(title)
         if tmdbResults:
+            providerError = providerError or tmdbResults['error']
             if thumb is None: thumb = tmdbResults['poster']
             if art is None: art = tmdbResults['backdrop']
             if rating is None: rating = tmdbResults['vote_average']
             if year is None: year = tmdbResults['year']
             if genres is None: genres = tmdbResults['genres']
 
-    return {
+    metadataResults = {
         'thumb': thumb,
         'art': art,
         'year': year,
@@ -1154,6 +2810,241 @@ def metadata(title, zap2itID=None):
         'genres': genres,
         'zap2itMissingID': zap2itMissingID }
 
+    # Cache the results unless a metadata provider was unavailable or a search failed
+    if tvdbToken is not False and tmdbBaseURL and not providerError:
+        metadataCacheSet(metadataKey, metadataResults)
+
+    return metadataResults
+
+
+# Search for metadata for several titles at the same time, returning results by (title, zap2itID)
+# Titles still being searched after metadataPageTimeout are left out, and their results are cached when found
+# Titles already being searched for another page or the prefetcher wait for that search instead of searching again
+def metadataBatch(metadataRequests):
+    metadataPage = {}
+    metadataPending = []
+    metadataWaiting = []
+
+    for title, zap2itID in metadataRequests:
+        if (title, zap2itID) in metadataPage:
+            continue
+
+        metadataKey = (' '.join(title.lower().split()), zap2itID)
+        metadataResults = metadataCacheGet(metadataKey)
+        metadataPage[(title, zap2itID)] = metadataResults
+        if metadataResults is None:
+            metadataSearch, metadataStarted = metadataSearchStart(metadataKey)
+            if metadataStarted:
+                metadataPending.append((metadataKey, metadataSearch, title, zap2itID))
+            metadataWaiting.append((metadataSearch, title, zap2itID))
+
+    if not metadataWaiting:
+        return metadataPage
+
+    metadataLock = Thread.Lock()
+
+    def metadataWorker():
+        while True:
+            with metadataLock:
+                if not metadataPending:
+                    return
+                metadataKey, metadataSearch, title, zap2itID = metadataPending.pop(0)
+
+            metadataSearchRun(metadataKey, metadataSearch, title, zap2itID)
+
+    for metadataThread in range(min(metadataThreads, len(metadataPending))):
+        Thread.Create(metadataWorker)
+
+    metadataDeadline = time.time() + metadataPageTimeout
+    metadataTimeout = False
+    for metadataSearch, title, zap2itID in metadataWaiting:
+        if metadataSearch['done'].wait(max(0, metadataDeadline - time.time())):
+            metadataPage[(title, zap2itID)] = metadataSearch['results']
+        else:
+            metadataTimeout = True
+
+    if metadataTimeout:
+        Log.Info('Metadata searches did not finish within ' + str(metadataPageTimeout) + ' seconds, continuing in the background')
+
+    return metadataPage
+
+
+# Register a metadata search for a title, returning the search and whether it was started by this request
+# A search already running for the title is returned instead, so its results can be waited for
+def metadataSearchStart(metadataKey):
+    Thread.AcquireLock('metadataSearches')
+    try:
+        metadataSearch = metadataSearches.get(metadataKey)
+        if metadataSearch:
+            return metadataSearch, False
+
+        metadataSearch = {'done': Thread.Event(), 'results': None}
+        metadataSearches[metadataKey] = metadataSearch
+        return metadataSearch, True
+
+    finally:
+        Thread.ReleaseLock('metadataSearches')
+
+
+# Run a registered metadata search, passing the results to requests waiting for the search
+def metadataSearchRun(metadataKey, metadataSearch, title, zap2itID):
+    try:
+        metadataSearch['results'] = metadata(title=title, zap2itID=zap2itID)
+    except Exception as e:
+        Log.Warn('Error searching for metadata for ' + title + ': ' + str(e))
+
+    finally:
+        Thread.AcquireLock('metadataSearches')
+        try:
+            metadataSearches.pop(metadataKey, None)
+        finally:
+            Thread.ReleaseLock('metadataSearches')
+
+        metadataSearch['done'].set()
+
+    return metadataSearch['results']
+
+
+# Get metadata results from the cache, moving the title to the end of the eviction order
+def metadataCacheGet(metadataKey):
+    Thread.AcquireLock('metadataCache')
+    try:
+        metadataCacheEntry = metadataCache.pop(metadataKey, None)
+        if metadataCacheEntry is None or time.time() >= metadataCacheEntry[0]:
+            statsCounters['metadataCache.misses'] += 1
+            return None
+
+        statsCounters['metadataCache.hits'] += 1
+
+        metadataCache[metadataKey] = metadataCacheEntry
+        return metadataCacheEntry[1]
+
+    finally:
+        Thread.ReleaseLock('metadataCache')
+
+
+# Add metadata results to the cache, evicting the least recently used titles when the cache is full
+def metadataCacheSet(metadataKey, metadataResults):
+    global metadataCacheChanged
+
+    if metadataResults['thumb'] or metadataResults['art']:
+        metadataExpires = time.time() + metadataCacheTime
+    else:
+        metadataExpires = time.time() + metadataMissCacheTime
+
+    Thread.AcquireLock('metadataCache')
+    try:
+        metadataCache.pop(metadataKey, None)
+        metadataCache[metadataKey] = (metadataExpires, metadataResults)
+        while len(metadataCache) > metadataCacheSize:
+            metadataCache.popitem(last=False)
+        metadataCacheChanged = True
+
+    finally:
+        Thread.ReleaseLock('metadataCache')
+
+
+# Load the metadata cache saved by a previous session
+def loadMetadataCache():
+    try:
+        if Data.Exists('metadataCache'):
+            now = time.time()
+            for metadataKey, metadataCacheEntry in Data.LoadObject('metadataCache'):
+                if now < metadataCacheEntry[0]:
+                    metadataCache[metadataKey] = metadataCacheEntry
+            Log.Info('Loaded metadata for ' + str(len(metadataCache)) + ' titles')
+
+    except Exception as e:
+        Log.Warn('Error loading the metadata cache: ' + str(e))
+
+
+# Save the metadata cache if it has changed
+def saveMetadataCache():
+    global metadataCacheChanged
+
+    if not metadataCacheChanged:
+        return
+
+    Thread.AcquireLock('metadataCache')
+    try:
+        metadataCacheItems = metadataCache.items()
+        metadataCacheChanged = False
+
+    finally:
+        Thread.ReleaseLock('metadataCache')
+
+    try:
+        Data.SaveObject('metadataCache', metadataCacheItems)
+    except Exception as e:
+        Log.Warn('Error saving the metadata cache: ' + str(e))
+
+
+# Searches for metadata and artwork of upcoming shows in the background, so the first client to display
+# a show after it starts does not wait on theTVDB and TMDb
+def metadataPrefetcher():
+    while True:
+        try:
+            snapshot = tvhSnapshot
+            if Prefs['prefMetadata'] and snapshot and snapshot['epg']:
+                prefetchCount = 0
+                for title, zap2itID in prefetchTitles(snapshot['epg']):
+                    metadataKey = (' '.join(title.lower().split()), zap2itID)
+                    if metadataCacheGet(metadataKey):
+                        continue
+
+                    # Skip titles already being searched for a page
+                    metadataSearch, metadataStarted = metadataSearchStart(metadataKey)
+                    if not metadataStarted:
+                        continue
+
+                    metadataResults = metadataSearchRun(metadataKey, metadataSearch, title, zap2itID)
+                    if metadataResults:
+                        prefetchImage(metadataResults['thumb'])
+                        prefetchImage(metadataResults['art'], imageArtWidth)
+                    prefetchCount += 1
+
+                    Thread.Sleep(1.0 / prefetchRate)
+
+                if prefetchCount: Log.Info('Prefetched metadata for ' + str(prefetchCount) + ' titles')
+
+        except Exception as e:
+            Log.Warn('Error prefetching metadata: ' + str(e))
+
+        Thread.Sleep(prefetchInterval)
+
+
+# List the titles airing now or starting within prefetchHours on all channels, sorted by start time
+def prefetchTitles(tvhEPGStore):
+    now = time.time()
+    prefetchEnd = now + prefetchHours * 3600
+    prefetchEntries = []
+
+    for epgChannel in tvhEPGStore['channels'].values():
+        epgStart = max(bisect.bisect_right(epgChannel['starts'], now) - 1, 0)
+        epgEnd = bisect.bisect_left(epgChannel['starts'], prefetchEnd)
+        for tvhEPGEntry in epgChannel['entries'][epgStart:epgEnd]:
+            if tvhEPGEntry.get('title') and now < int(tvhEPGEntry['stop']):
+                prefetchEntries.append((int(tvhEPGEntry['start']), tvhEPGEntry['title'], epgZap2itID(tvhEPGEntry)))
+
+    prefetchEntries.sort(key=lambda e: e[0])
+    prefetchList = []
+    prefetchSeen = set()
+
+    for prefetchStart, title, zap2itID in prefetchEntries:
+        if (title, zap2itID) not in prefetchSeen:
+            prefetchSeen.add((title, zap2itID))
+            prefetchList.append((title, zap2itID))
+
+    return prefetchList
+
+
+# Request artwork so it is cached before it is displayed
+def prefetchImage(url, width=None):
+    if url is None:
+        return
+
+    cachedImage(url, width)
+
 
 # Retrieve an authorization token from theTVDB
 @route(PREFIX + '/tvdbauth')
@@ -1209,21 +3100,21 @@ def tvdb(title, zap2itID, zap2itMissingID=None):
                     Log.Info('theTVDB previously had no results for ' + title + ', will try again after {} minutes.'.format(m))
             return None
 
-    # Request an authorization token if it doesn't exist
+    # Request an authorization token if it doesn't exist - searches running at the same time wait for a single request
     if tvdbToken is None:
-        Log.Info('Requesting an authorization token for theTVDB')
-        tvdbAuth()
+        Thread.AcquireLock('tvdbAuth')
+        try:
+            if tvdbToken is None:
+                Log.Info('Requesting an authorization token for theTVDB')
+                tvdbAuth()
+        finally:
+            Thread.ReleaseLock('tvdbAuth')
+
         return tvdb(title, zap2itID)
 
     elif not tvdbToken:
         Log.Info('theTVDB authorization failed.')
-        return {
-          'poster': tvdbPosterSearchURL,
-          'fanart': tvdbFanartSearchURL,
-          'rating': tvdbRating,
-          'siteRating': tvdbSiteRating,
-          'genres': tvdbGenres,
-          'zap2itMissingID': zap2itMissingID}
+        return tvdbError(zap2itMissingID)
 
     # Search using zap2it ID if available, otherwise search by name
     tvdbHeaders = {'Authorization' : 'Bearer %s' % tvdbToken}
@@ -1271,7 +3162,7 @@ def tvdb(title, zap2itID, zap2itMissingID=None):
 
         else:
             Log.Warn('Error while searching theTVDB: ' + str(e))
-            return None
+            return tvdbError(zap2itMissingID)
 
     if tvdbID:
         tvdbPosterSearchURL = 'https://api.thetvdb.com/series/{}/images/query?keyType=poster'.format(tvdbID)
@@ -1314,7 +3205,20 @@ def tvdb(title, zap2itID, zap2itMissingID=None):
         'rating': tvdbRating,
         'siteRating': tvdbSiteRating,
         'genres': tvdbGenres,
-        'zap2itMissingID': zap2itMissingID}
+        'zap2itMissingID': zap2itMissingID,
+        'error': False}
+
+
+# Results for a theTVDB search that failed due to an error, which are not cached as a title without results
+def tvdbError(zap2itMissingID):
+    return {
+        'poster': None,
+        'fanart': None,
+        'rating': None,
+        'siteRating': None,
+        'genres': None,
+        'zap2itMissingID': zap2itMissingID,
+        'error': True}
 
 
 # Search The Movie Database for metadata
@@ -1327,6 +3231,7 @@ def tmdb(title):
     tmdbVoteAverage = 0.0
     tmdbSearchURL = 'https://api.themoviedb.org/3/search/multi?api_key=0fd2136e80c47d0e371ee1af87eaedde&query={}'.format(String.Quote(title))
     tmdbGenres = None
+    tmdbError = False
 
     # Search
     try:
@@ -1334,9 +3239,11 @@ def tmdb(title):
 
     except Exception as e:
         Log.Warn('Error retrieving TMDb data:  ' + str(e))
+        tmdbError = True
 
     if tmdbData is None:
-        Log.Info('No results from TMDb for ' + title)
+        if not tmdbError:
+            Log.Info('No results from TMDb for ' + title)
 
     # Check for a matching movie or TV show
     elif int(tmdbData['total_results']) > 0 :
@@ -1380,4 +3287,5 @@ def tmdb(title):
         'backdrop': tmdbBackdrop,
         'year': tmdbYear,
         'vote_average': tmdbVoteAverage,
-        'genres': tmdbGenres}
+        'genres': tmdbGenres,
+        'error': tmdbError}